@@ -13,16 +13,24 @@ class DataConfig:
 
     movies_file: pathlib.Path = None
     ratings_file: pathlib.Path = None
+    artifacts_dir: pathlib.Path = None
+    columns_dir: pathlib.Path = None     # cache cột nhị phân (.npy) của CSV gốc
+
+    # bộ nhớ tối đa cho mỗi chunk khi đọc/stream ratings (MB)
+    memory_budget_mb: int = 256
 
     def __post_init__(self):
         self.movies_file = self.raw_dir / "movies.csv"
         self.ratings_file = self.raw_dir / "ratings.csv"
+        self.artifacts_dir = self.processed_dir / "artifacts"
+        self.columns_dir = self.processed_dir / "columns"
 
 
 @dataclass
 class ModelConfig:
     user_based_neighbors: int = 25
     item_based_neighbors: int = 20
+    similarity_block_size: int = 1024
     min_interactions_user: int = 5
     min_interactions_item: int = 5
 
@@ -30,14 +38,92 @@ class ModelConfig:
     learning_rate: float = 0.01
     reg: float = 0.02
     epochs: int = 10
+    mf_solver: str = "sgd"           # "sgd" | "als"
+    mf_batch_size: int = 8192
+    validation_fraction: float = 0.05
+    early_stopping_patience: int = 2
+    popularity_damping: float = 10.0  # fallback cho user chưa biết: điểm TB có "làm mượt" của mỗi phim
+    partial_fit_epochs: int = 3     # số epoch SGD trên các rating mới khi cập nhật tăng dần
+
+    # MF top-N: "ivf" = chỉ mục inner-product xấp xỉ (src/mips.py), "exact" = quét toàn bộ
+    mf_index: str = "ivf"
+    ann_lists: int = 0            # 0 = sqrt(số phim)
+    ann_probe: int = 16
+    ann_min_items: int = 4096     # catalog nhỏ hơn -> quét toàn bộ vẫn rẻ hơn
+    ann_recall_sample: int = 100  # cứ N lần tìm IVF thì so với quét toàn bộ -> metric mf_ivf_recall_* (0 = tắt)
+    n_jobs: int = -1                 # -1 = all cores
+    parallel_backend: str = "thread"  # "thread" | "process"
+    scoring_block_size: int = 256
+
+    # "none" | "minmax" | "zscore", applied to each model's scores before fusion
+    hybrid_normalization: str = "none"
 
 
 @dataclass
 class WebConfig:
     default_user_id: int = 1
     recommendations_limit: int = 10
+    use_artifacts: bool = True    # nạp model đã lưu thay vì huấn luyện lại khi khởi động
+    mmap_artifacts: bool = True   # mở mảng lớn dạng memory-map chỉ đọc, dùng chung giữa các worker
+    # model dựng ngay sau khi khởi động (ở background); model khác chỉ nạp/huấn luyện khi được dùng lần đầu
+    preload_models: tuple = ("hybrid",)   # () = không nạp trước; ALGORITHMS = nạp tất cả
+
+    # cache kết quả gợi ý: LRU trong bộ nhớ + 1 file SQLite trên đĩa
+    result_cache_mb: int = 64
+    result_cache_disk: bool = True
+    result_cache_disk_max_entries: int = 100_000
+
+    # chỉ xếp hạng top-K ứng viên cho mỗi user; mở rộng (x2) khi client lật quá trang cuối
+    candidate_pool: int = 500
+
+    # POST /api/recommendations/batch: số user tối đa mỗi request
+    batch_max_users: int = 1000
+
+    # gợi ý tính sẵn cho mọi user (python web_app/batch_job.py), phục vụ trực tiếp khi có
+    use_precomputed: bool = True
+    batch_top_n: int = 500
+    batch_chunk_users: int = 8192
+
+    # POST /api/ratings: gom rating trong khoảng này rồi cập nhật model ở background
+    update_interval_s: float = 2.0
+
+    # phục vụ production (python web_app/app.py --serve): model nạp ở background,
+    # chấm điểm chạy trong pool có giới hạn, quá tải -> 503 thay vì xếp hàng vô hạn
+    host: str = "127.0.0.1"
+    port: int = 5000
+    server_threads: int = 16
+    scoring_workers: int = 4
+    scoring_max_pending: int = 32
+    scoring_timeout_s: float = 10.0
+
+
+@dataclass
+class EvalConfig:
+    # đánh giá offline (python -m src.offline_eval): tách ngẫu nhiên rating của từng user
+    test_fraction: float = 0.2
+    min_train_ratings: int = 1      # user luôn giữ lại ít nhất chừng này rating để huấn luyện
+    relevance_threshold: float = 4.0  # rating test >= ngưỡng -> phim "liên quan" (gain = rating)
+    k: int = 10
+    seed: int = 42
+    max_users: int = 0              # 0 = mọi user có phim liên quan trong tập test
+
+
+@dataclass
+class MonitoringConfig:
+    # đo thời gian từng bước (src/metrics.py, GET /metrics); False -> gần như không tốn gì
+    metrics_enabled: bool = True
+    log_format: str = "text"        # "text" | "json" (mỗi request một dòng JSON)
+    log_level: str = "INFO"
+
+    # profile một request cụ thể: bật cờ này rồi gửi header X-Profile / ?profile=<token>
+    # (kết quả ghi vào data/processed/profiles); token rỗng = giá trị nào cũng được
+    profiling_enabled: bool = False
+    profile_token: str = ""
+    profile_top: int = 25
 
 
 data_config = DataConfig()
 model_config = ModelConfig()
 web_config = WebConfig()
+eval_config = EvalConfig()
+monitoring_config = MonitoringConfig()
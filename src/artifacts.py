@@ -0,0 +1,205 @@
+# artifacts.py
+"""On-disk model artifacts: one directory of ``.npy`` arrays + ``meta.json`` per model.
+
+Layout::
+
+    <root>/<fingerprint>/manifest.json
+    <root>/<fingerprint>/<model name>/meta.json
+    <root>/<fingerprint>/<model name>/<array>.npy
+
+The fingerprint covers the raw input files and the ``ModelConfig`` fields that
+shape the trained arrays (TRAINED_FIELDS), so artifacts trained on other data
+or settings are never loaded by mistake, while runtime-only settings such as
+``n_jobs`` do not force a retrain.
+
+Several processes may cold-start on the same data at once: each writes
+aside, then publishes under ``<root>/.lock``, and a directory another
+process already published is kept rather than replaced.
+"""
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+from contextlib import contextmanager
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+# Các trường ModelConfig thay đổi mảng được huấn luyện; các trường còn lại (n_jobs,
+# block size, ann_probe, hybrid_normalization, ...) chỉ ảnh hưởng lúc chạy -> không retrain
+TRAINED_FIELDS = (
+    "user_based_neighbors",
+    "item_based_neighbors",
+    "min_interactions_user",
+    "min_interactions_item",
+    "latent_factors",
+    "learning_rate",
+    "reg",
+    "epochs",
+    "mf_solver",
+    "mf_batch_size",
+    "validation_fraction",
+    "early_stopping_patience",
+    "popularity_damping",
+    "mf_index",
+    "ann_lists",
+    "ann_min_items",
+)
+
+
+def save_arrays(path, arrays, meta=None):
+    path = pathlib.Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+    for name, array in arrays.items():
+        np.save(path / f"{name}.npy", np.ascontiguousarray(array), allow_pickle=False)
+    with open(path / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta or {}, f)
+
+
+def load_arrays(path, mmap_mode=None):
+    """Return ``(arrays, meta)`` for a directory written by save_arrays."""
+    path = pathlib.Path(path)
+    arrays = {
+        p.stem: np.load(p, mmap_mode=mmap_mode, allow_pickle=False)
+        for p in sorted(path.glob("*.npy"))
+    }
+    with open(path / "meta.json", encoding="utf-8") as f:
+        meta = json.load(f)
+    return arrays, meta
+
+
+def encode_strings(values):
+    """Pack strings into a UTF-8 byte blob plus int64 offsets (no pickled object arrays)."""
+    encoded = [("" if v is None else str(v)).encode("utf-8") for v in values]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(b) for b in encoded])
+    blob = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return blob, offsets
+
+
+class StringColumn:
+    """Read-only string array over an (optionally memory-mapped) blob + offsets.
+
+    Strings are decoded only when indexed, so a memory-mapped column costs no
+    per-process memory until it is used.
+    """
+
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _get(self, i):
+        return bytes(self.blob[self.offsets[i]:self.offsets[i + 1]]).decode("utf-8")
+
+    def __getitem__(self, idx):
+        if np.isscalar(idx):
+            return self._get(int(idx))
+        idx = np.arange(len(self))[idx] if isinstance(idx, slice) else np.asarray(idx)
+        return np.array([self._get(i) for i in idx], dtype=object)
+
+    def __iter__(self):
+        return (self._get(i) for i in range(len(self)))
+
+
+def fingerprint(data_cfg, model_cfg):
+    """Hash of the input files (name, size, mtime) and the model settings in TRAINED_FIELDS."""
+    files = []
+    for path in (data_cfg.movies_file, data_cfg.ratings_file):
+        path = pathlib.Path(path)
+        stat = path.stat()
+        files.append([path.name, stat.st_size, stat.st_mtime_ns])
+    payload = {
+        "format_version": FORMAT_VERSION,
+        "files": files,
+        "model_config": {name: getattr(model_cfg, name) for name in TRAINED_FIELDS},
+    }
+    raw = json.dumps(payload, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(raw).hexdigest()[:20]
+
+
+class ArtifactStore:
+    """Versioned artifact directories under ``root``, one per fingerprint."""
+
+    def __init__(self, root):
+        self.root = pathlib.Path(root)
+
+    def path(self, key):
+        return self.root / key
+
+    def manifest(self, key):
+        path = self.path(key) / "manifest.json"
+        if not path.exists():
+            return None
+        with open(path, encoding="utf-8") as f:
+            manifest = json.load(f)
+        if manifest.get("format_version") != FORMAT_VERSION or manifest.get("fingerprint") != key:
+            return None
+        return manifest
+
+    def is_valid(self, key):
+        return self.manifest(key) is not None
+
+    @contextmanager
+    def _publishing(self):
+        """Exclusive lock over ``root`` between processes (no-op where fcntl is missing)."""
+        try:
+            import fcntl
+        except ImportError:   # Windows
+            yield
+            return
+        with open(self.root / ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def save(self, key, writer, extra=None):
+        """Write a new version: ``writer(directory)`` fills a temp directory that is then
+        renamed into place, so readers never see a half-written artifact. Older
+        versions are removed afterwards."""
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp = self.root / f".{key}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        writer(tmp)
+        manifest = {"format_version": FORMAT_VERSION, "fingerprint": key, **(extra or {})}
+        with open(tmp / "manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+
+        target = self.path(key)
+        with self._publishing():
+            if self.is_valid(key):
+                # process khác đã publish cùng version (có thể kèm model) -> giữ bản đó
+                shutil.rmtree(tmp, ignore_errors=True)
+            else:
+                shutil.rmtree(target, ignore_errors=True)   # chỉ còn lại bản dở dang
+                os.replace(tmp, target)
+            for old in self.root.iterdir():
+                if old.is_dir() and old.name != key and not old.name.startswith("."):
+                    shutil.rmtree(old, ignore_errors=True)
+        return target
+
+    def save_part(self, key, name, writer):
+        """Add one model directory to an existing version (written aside, then renamed in).
+
+        A part another process already added is kept and this copy dropped.
+        """
+        version = self.path(key)
+        tmp = version / f".{name}.tmp-{os.getpid()}"
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir(parents=True)
+        writer(tmp)
+        target = version / name
+        with self._publishing():
+            # part chỉ xuất hiện qua rename -> đã tồn tại nghĩa là đã đầy đủ
+            if target.exists():
+                shutil.rmtree(tmp, ignore_errors=True)
+            else:
+                os.replace(tmp, target)
+        return target
@@ -0,0 +1,112 @@
+# batch.py
+"""Offline top-N recommendations for many users, stored as memory-mappable arrays.
+
+Layout (one directory per algorithm)::
+
+    <root>/<algorithm>/user_ids.npy    sorted user ids (int32)
+    <root>/<algorithm>/movie_ids.npy   (users × top_n) int32, padded with -1
+    <root>/<algorithm>/scores.npy      (users × top_n) float32, padded with NaN
+    <root>/<algorithm>/totals.npy      number of rankable movies per user (int32)
+    <root>/<algorithm>/meta.json
+
+A ranker is any ``fn(user_ids) -> (user_ids, movie_ids, scores, totals)``,
+i.e. a model's ``rank_many`` with its other arguments bound.
+"""
+import json
+import os
+import pathlib
+import shutil
+import time
+
+import numpy as np
+
+from src.artifacts import load_arrays
+from src.sparse_matrix import IdIndex
+
+
+def write_recommendations(path, ranker, user_ids, top_n, chunk_users=8192, meta=None, log=print):
+    """Rank ``user_ids`` chunk by chunk and stream the results to ``path``.
+
+    Output arrays are filled through ``open_memmap`` so memory stays bounded by
+    one chunk; the directory is renamed into place once complete. Returns the
+    throughput in users/second.
+    """
+    path = pathlib.Path(path)
+    user_ids = np.unique(np.asarray(user_ids))
+    n = len(user_ids)
+    tmp = path.with_name(f".{path.name}.tmp-{os.getpid()}")
+    shutil.rmtree(tmp, ignore_errors=True)
+    tmp.mkdir(parents=True)
+
+    out_users = np.lib.format.open_memmap(tmp / "user_ids.npy", mode="w+", dtype=np.int32, shape=(n,))
+    out_movies = np.lib.format.open_memmap(tmp / "movie_ids.npy", mode="w+", dtype=np.int32, shape=(n, top_n))
+    out_scores = np.lib.format.open_memmap(tmp / "scores.npy", mode="w+", dtype=np.float32, shape=(n, top_n))
+    out_totals = np.lib.format.open_memmap(tmp / "totals.npy", mode="w+", dtype=np.int32, shape=(n,))
+
+    # người dùng không xếp hạng được (không có trong model) bị bỏ qua -> chỉ ghi tới `filled`
+    filled = 0
+    t0 = time.perf_counter()
+    for start in range(0, n, chunk_users):
+        users, movie_ids, scores, totals = ranker(user_ids[start:start + chunk_users])
+        end = filled + len(users)
+        out_users[filled:end] = users
+        out_movies[filled:end] = movie_ids
+        out_scores[filled:end] = scores
+        out_totals[filled:end] = totals
+        filled = end
+        done = min(start + chunk_users, n)
+        rate = done / max(time.perf_counter() - t0, 1e-9)
+        log(f"[Batch] {path.name}: {done}/{n} users, {rate:,.0f} users/s")
+
+    for array in (out_users, out_movies, out_scores, out_totals):
+        array.flush()
+    del out_users, out_movies, out_scores, out_totals
+
+    elapsed = time.perf_counter() - t0
+    meta = {**(meta or {}), "top_n": top_n, "users": filled, "seconds": round(elapsed, 3)}
+    with open(tmp / "meta.json", "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp, path)
+    return filled / max(elapsed, 1e-9)
+
+
+class PrecomputedRecommendations:
+    """Read side of write_recommendations: per-user top-N rows from (memory-mapped) arrays."""
+
+    def __init__(self, user_ids, movie_ids, scores, totals, meta=None):
+        self.index = IdIndex(user_ids)
+        self.movie_ids = movie_ids
+        self.scores = scores
+        self.totals = totals
+        self.meta = meta or {}
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        arrays, meta = load_arrays(path, mmap_mode)
+        # chỉ dùng phần đã ghi (user không xếp hạng được nằm ở cuối, chưa điền)
+        n = meta.get("users", len(arrays["user_ids"]))
+        return cls(
+            arrays["user_ids"][:n],
+            arrays["movie_ids"][:n],
+            arrays["scores"][:n],
+            arrays["totals"][:n],
+            meta,
+        )
+
+    @property
+    def top_n(self):
+        return self.movie_ids.shape[1]
+
+    def __contains__(self, user_id):
+        return user_id in self.index
+
+    def get(self, user_id):
+        """``(movie_ids, scores, total)`` for ``user_id`` without padding, or None if it was not precomputed."""
+        u = self.index.index(user_id)
+        if u < 0:
+            return None
+        movie_ids = np.asarray(self.movie_ids[u])
+        keep = movie_ids >= 0
+        return movie_ids[keep], np.asarray(self.scores[u])[keep], int(self.totals[u])
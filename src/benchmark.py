@@ -0,0 +1,258 @@
+# benchmark.py
+"""Speed / memory benchmark of every model on synthetic ratings (no dataset download needed).
+
+    python -m src.benchmark --size small
+    python -m src.benchmark --users 50000 --items 8000 --density 0.004 --models user_cf svd
+    python -m src.benchmark --size medium --compare data/processed/benchmarks/baseline.json
+
+For each model it times fit, single predict, a full single-user recommend
+and batch recommend (rank_many), and records tracemalloc peaks of fit and
+the batch in separate runs, so tracing does not inflate the timings.
+Results are JSON (environment + config + numbers) so runs can be compared;
+``--compare`` prints the change against an earlier file and exits with
+status 1 when something got slower than ``--tolerance`` allows.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict
+
+import numpy as np
+import pandas as pd
+import scipy
+
+from config import data_config, model_config
+from src.collaborative_filtering import ItemBasedCF, UserBasedCF
+from src.hybrid_model import HybridRecommender
+from src.matrix_factorization import MFRecommender
+from src.metadata import MovieMetadata
+from src.sparse_matrix import RatingMatrix
+
+MODELS = ("user_cf", "item_cf", "svd", "hybrid")
+
+# (users, items, density)
+SIZES = {
+    "tiny": (500, 300, 0.05),
+    "small": (2_000, 1_000, 0.02),
+    "medium": (20_000, 5_000, 0.005),
+    "large": (100_000, 20_000, 0.002),
+}
+
+# chỉ số "càng thấp càng tốt" / "càng cao càng tốt" dùng khi so sánh hai lần chạy
+_LOWER_IS_BETTER = ("fit_s", "predict_us", "recommend_ms", "fit_peak_mb", "batch_peak_mb")
+_HIGHER_IS_BETTER = ("batch_users_per_s",)
+
+
+def synthetic_ratings(n_users, n_items, density=0.01, seed=0, factors=8):
+    """``(RatingMatrix, movies DataFrame)`` with MovieLens-like structure.
+
+    Item popularity follows a Zipf-like curve and user activity a log-normal,
+    so the sparsity pattern is skewed like real data; ratings come from user /
+    item biases plus a low-rank term, rounded to half stars in [0.5, 5].
+    """
+    rng = np.random.default_rng(seed)
+    n = int(n_users * n_items * density)
+    item_p = 1.0 / np.arange(1, n_items + 1) ** 0.8
+    item_p = rng.permutation(item_p / item_p.sum())
+    user_p = rng.lognormal(0.0, 1.0, n_users)
+    user_p /= user_p.sum()
+
+    keys = np.unique(rng.choice(n_users, n, p=user_p).astype(np.int64) * n_items + rng.choice(n_items, n, p=item_p))
+    users, items = keys // n_items, keys % n_items
+
+    user_vec = rng.normal(0, 0.5, (n_users, factors)).astype(np.float32)
+    item_vec = rng.normal(0, 0.5, (n_items, factors)).astype(np.float32)
+    raw = (
+        3.5
+        + rng.normal(0, 0.4, n_users)[users]
+        + rng.normal(0, 0.4, n_items)[items]
+        + np.einsum("ij,ij->i", user_vec[users], item_vec[items])
+        + rng.normal(0, 0.5, len(keys))
+    )
+    ratings = np.clip(np.round(raw * 2) / 2, 0.5, 5.0).astype(np.float32)
+
+    matrix = RatingMatrix.from_arrays(users + 1, items + 1, ratings)
+    movies = pd.DataFrame({"movieId": matrix.item_ids, "title": [f"Movie {i}" for i in matrix.item_ids]})
+    return matrix, movies
+
+
+def _median_seconds(fn, args_list):
+    times = []
+    for args in args_list:
+        t0 = time.perf_counter()
+        fn(*args)
+        times.append(time.perf_counter() - t0)
+    return float(np.median(times)) if times else 0.0
+
+
+def _timed(fn):
+    """``(result, seconds)`` of ``fn()``."""
+    t0 = time.perf_counter()
+    result = fn()
+    return result, time.perf_counter() - t0
+
+
+def _peak_mb(fn):
+    """Peak traced allocation (MB) of ``fn()``.
+
+    Run separately from the timed call: tracemalloc slows allocation-heavy
+    code down noticeably, which would skew the timings compared across runs.
+    """
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / 2**20
+
+
+def _max_rss_mb():
+    try:
+        import resource
+    except ImportError:   # Windows
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux báo KB, macOS báo byte
+    return rss / 2**20 if sys.platform == "darwin" else rss / 2**10
+
+
+def benchmark_models(matrix, movies, models=MODELS, top_n=10, n_predict=200, n_recommend=20,
+                     batch_users=2000, seed=0, log=print):
+    """Timings and memory peaks per model name on one dataset."""
+    rng = np.random.default_rng(seed)
+    metadata = MovieMetadata.from_movies(movies)
+    users = matrix.user_ids
+    pairs = list(zip(rng.choice(users, n_predict), rng.choice(matrix.item_ids, n_predict)))
+    single_users = rng.choice(users, min(n_recommend, len(users)), replace=False)
+    batch = np.sort(rng.choice(users, min(batch_users, len(users)), replace=False))
+
+    fitted, results = {}, {}
+    builders = {"user_cf": UserBasedCF, "item_cf": ItemBasedCF, "svd": MFRecommender}
+    needed = set(models) | ({"user_cf", "svd"} if "hybrid" in models else set())
+    for name in MODELS:
+        if name in builders and name in needed:
+            fitted[name], fit_s = _timed(lambda: builders[name]().fit(matrix))
+            results[name] = {"fit_s": fit_s, "fit_peak_mb": _peak_mb(lambda: builders[name]().fit(matrix))}
+    if "hybrid" in models:
+        fitted["hybrid"] = HybridRecommender(user_cf=fitted["user_cf"], mf=fitted["svd"], w_cf=0.5, w_mf=0.5)
+        results["hybrid"] = {
+            "fit_s": results["user_cf"]["fit_s"] + results["svd"]["fit_s"],
+            "fit_peak_mb": max(results["user_cf"]["fit_peak_mb"], results["svd"]["fit_peak_mb"]),
+        }
+
+    for name in models:
+        model, out = fitted[name], results[name]
+        if name == "hybrid":
+            out["predict_us"] = 1e6 * _median_seconds(lambda u, i: model.score_items(u, [i]), pairs)
+            out["recommend_ms"] = 1e3 * _median_seconds(
+                lambda u: model.rank(u, metadata, top_n), [(u,) for u in single_users]
+            )
+            batch_fn = lambda: model.rank_many(batch, metadata, top_n)
+        else:
+            out["predict_us"] = 1e6 * _median_seconds(model.predict, pairs)
+            out["recommend_ms"] = 1e3 * _median_seconds(lambda u: model.rank(u, top_n), [(u,) for u in single_users])
+            batch_fn = lambda: model.rank_many(batch, top_n)
+        _, batch_s = _timed(batch_fn)
+        out["batch_users_per_s"] = len(batch) / max(batch_s, 1e-9)
+        out["batch_peak_mb"] = _peak_mb(batch_fn)
+        results[name] = {key: round(value, 3) for key, value in out.items()}
+        log(
+            f"[Bench] {name}: fit {out['fit_s']:.2f}s ({out['fit_peak_mb']:.0f} MB peak), "
+            f"predict {out['predict_us']:.0f} us, recommend {out['recommend_ms']:.1f} ms, "
+            f"batch {out['batch_users_per_s']:,.0f} users/s ({out['batch_peak_mb']:.0f} MB peak)"
+        )
+    return {name: results[name] for name in models}
+
+
+def environment():
+    return {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(baseline, current, tolerance=0.2):
+    """Lines describing every metric change and the list of regressions beyond ``tolerance``."""
+    lines, regressions = [], []
+    for name, metrics in current["results"].items():
+        old = baseline.get("results", {}).get(name)
+        if old is None:
+            continue
+        for key in _LOWER_IS_BETTER + _HIGHER_IS_BETTER:
+            if key not in metrics or not old.get(key):
+                continue
+            change = metrics[key] / old[key] - 1.0
+            worse = change > tolerance if key in _LOWER_IS_BETTER else change < -tolerance
+            line = f"{name:8s} {key:18s} {old[key]:>12,.3f} -> {metrics[key]:>12,.3f} ({change:+.1%})"
+            lines.append(line + ("  REGRESSION" if worse else ""))
+            if worse:
+                regressions.append(line)
+    return lines, regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size", choices=sorted(SIZES), default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--items", type=int)
+    parser.add_argument("--density", type=float)
+    parser.add_argument("--models", nargs="+", choices=MODELS, default=list(MODELS))
+    parser.add_argument("--top-n", type=int, default=10)
+    parser.add_argument("--batch-users", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="JSON output (default: data/processed/benchmarks/<size>-<time>.json)")
+    parser.add_argument("--compare", help="earlier JSON result to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative slowdown")
+    args = parser.parse_args(argv)
+
+    n_users, n_items, density = SIZES[args.size]
+    n_users, n_items = args.users or n_users, args.items or n_items
+    density = args.density or density
+
+    t0 = time.perf_counter()
+    matrix, movies = synthetic_ratings(n_users, n_items, density, args.seed)
+    print(
+        f"[Bench] Synthetic data: users={matrix.shape[0]}, items={matrix.shape[1]}, "
+        f"ratings={matrix.nnz} ({time.perf_counter() - t0:.1f}s)"
+    )
+    results = benchmark_models(matrix, movies, args.models, args.top_n, batch_users=args.batch_users, seed=args.seed)
+    report = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "dataset": {"users": matrix.shape[0], "items": matrix.shape[1], "ratings": matrix.nnz,
+                    "density": density, "seed": args.seed},
+        "model_config": asdict(model_config),
+        "results": results,
+        "max_rss_mb": _max_rss_mb(),
+    }
+
+    out = args.out or data_config.processed_dir / "benchmarks" / f"{args.size}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"[Bench] Results written to {out}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            baseline = json.load(f)
+        if baseline.get("dataset") != report["dataset"]:
+            print("[Bench] Warning: baseline was run on a different dataset")
+        lines, regressions = compare(baseline, report, args.tolerance)
+        print("\n".join(lines))
+        if regressions:
+            print(f"[Bench] {len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
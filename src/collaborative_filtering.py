@@ -1,14 +1,40 @@
 # collaborative_filtering.py
+import logging
+import pathlib
+
 import numpy as np
-import pandas as pd
+import scipy.sparse as sp
 from dataclasses import dataclass
 from config import model_config
+from src.metadata import as_metadata
+from src.metrics import registry
+from src.neighbors import NeighborIndex, build_neighbor_index, normalize_rows, update_neighbor_index
+from src.ranking import combine_weighted, top_n_for_users, top_n_indices
+from src.artifacts import load_arrays, save_arrays
+from src.sparse_matrix import RatingMatrix, binary_pattern, build_csr, csr_arrays, csr_from_arrays
+
+logger = logging.getLogger(__name__)
+
 
+def _neighbor_matrix(neighbors, n_cols, absolute=False):
+    """Sparse (rows × n_cols) matrix holding each row's neighbor weights."""
+    ids = neighbors.ids
+    weights = np.abs(neighbors.weights) if absolute else neighbors.weights
+    valid = ids >= 0
+    rows = np.repeat(np.arange(ids.shape[0]), ids.shape[1])[valid.ravel()]
+    return sp.csr_matrix(
+        (weights[valid], (rows, ids[valid])),
+        shape=(ids.shape[0], n_cols),
+        dtype=np.float32,
+    )
 
-def cosine_similarity_manual(matrix):
-    norm = np.linalg.norm(matrix, axis=1, keepdims=True)
-    norm_matrix = matrix / (norm + 1e-10)
-    return norm_matrix @ norm_matrix.T
+
+def _pairwise_scores(neighbor_ids, weights, ratings, fallback):
+    """Shared aggregation for predict_many: ``neighbor_ids``/``weights``/``ratings`` are (pairs × k)."""
+    rated = (ratings > 0) & (neighbor_ids >= 0)
+    numer = np.where(rated, ratings * weights, 0).sum(axis=1)
+    denom = np.where(rated, np.abs(weights), 0).sum(axis=1)
+    return combine_weighted(numer, denom, fallback)
 
 
 @dataclass
@@ -18,111 +44,316 @@ class Recommendation:
     metadata: dict | None = None
 
 
-class UserBasedCF:
-    def __init__(self, cfg=model_config):
-        self.k = cfg.user_based_neighbors
+class _NeighborhoodCF:
+    """Shared encoding / ranking logic of the user- and item-based models."""
 
-    def fit(self, ratings):
-        matrix = ratings.pivot_table(index="userId", columns="movieId", values="rating").fillna(0)
-        print(f"[UserCF] Building similarity: users={matrix.shape[0]}, items={matrix.shape[1]}, k={self.k}")
-        self.matrix = matrix
-        self.similarity = pd.DataFrame(
-            cosine_similarity_manual(matrix.to_numpy()),
-            index=matrix.index,
-            columns=matrix.index,
-        )
-        print("[UserCF] Similarity matrix computed")
+    # sparse matrices derived by _prepare_scoring, persisted so loading skips the rebuild
+    _scoring_matrices = ()
+    _metric_name = "cf"      # nhãn "model" của metric model_fit_seconds
+
+    def save(self, path):
+        path = pathlib.Path(path)
+        self.matrix.save(path / "matrix")
+        self.neighbors.save(path / "neighbors")
+        arrays = {"user_means": self._user_means, "popularity": self._popularity}
+        for name in self._scoring_matrices:
+            arrays.update(csr_arrays(name.lstrip("_"), getattr(self, name)))
+        save_arrays(path / "scoring", arrays)
+
+    @classmethod
+    def load(cls, path, cfg=model_config, mmap_mode=None):
+        """Rebuild a fitted model from ``save()`` output without recomputing similarities.
+
+        With ``mmap_mode="r"`` every array is a read-only memory map, so worker
+        processes loading the same artifact share one copy via the page cache.
+        """
+        path = pathlib.Path(path)
+        model = cls(cfg)
+        model.matrix = RatingMatrix.load(path / "matrix", mmap_mode)
+        model.neighbors = NeighborIndex.load(path / "neighbors", mmap_mode)
+        if (path / "scoring").exists():
+            arrays, _ = load_arrays(path / "scoring", mmap_mode)
+            model._user_means = arrays["user_means"]
+            model._popularity = arrays.get("popularity")
+            if model._popularity is None:
+                model._popularity = model.matrix.item_popularity(cfg.popularity_damping)
+            for name in cls._scoring_matrices:
+                setattr(model, name, csr_from_arrays(name.lstrip("_"), arrays))
+        else:
+            model._prepare_scoring()
+        return model
+
+    def partial_fit(self, new_ratings):
+        """Merge new ratings (DataFrame or RatingMatrix) without a full refit.
+
+        Only the neighbor lists the new ratings can change are recomputed.
+        Attributes are rebound to new objects, never written in place, so a
+        ``copy.copy`` of a fitted model can be updated while the original
+        keeps serving.
+        """
+        delta = new_ratings if isinstance(new_ratings, RatingMatrix) else RatingMatrix.from_frame(new_ratings)
+        with registry.timer("model_fit_seconds", model=self._metric_name, phase="partial_fit"):
+            matrix, user_remap, item_remap = self.matrix.merged(delta)
+            self.neighbors = self._update_neighbors(matrix, delta, user_remap, item_remap)
+            self.matrix = matrix
+            self._prepare_scoring()
         return self
 
+    def _encode_pairs(self, user_ids, movie_ids):
+        u = self.matrix.user_index.encode(np.asarray(user_ids).ravel())
+        i = self.matrix.item_index.encode(np.asarray(movie_ids).ravel())
+        return u, i
+
     def predict(self, userId, movieId):
-        if userId not in self.matrix.index:
-            return 0
-        if movieId not in self.matrix.columns:
-            return 0
+        return float(self.predict_many([userId], [movieId])[0])
 
-        sims = self.similarity.loc[userId].drop(userId, errors="ignore")
-        neighbors = sims.nlargest(self.k)
-        neigh_ratings = self.matrix.loc[neighbors.index, movieId]
+    def predict_many(self, user_ids, movie_ids):
+        """Predictions for (user_ids[j], movie_ids[j]) pairs; 0 for unknown movies, popularity for unknown users."""
+        u, i = self._encode_pairs(user_ids, movie_ids)
+        out = np.zeros(len(u), dtype=np.float32)
+        cold = (u < 0) & (i >= 0)
+        out[cold] = self._popularity[i[cold]]
+        known = (u >= 0) & (i >= 0)
+        if known.any():
+            out[known] = self._predict_pairs(u[known], i[known])
+        return out
 
-        mask = neigh_ratings > 0
-        if mask.sum() == 0:
-            return float(self.matrix.loc[userId].replace(0, np.nan).mean())
+    def score_users(self, user_ids, movie_ids):
+        """(users × movies) score matrix in the given orders; 0 for unknown movies, popularity for unknown users."""
+        u = self.matrix.user_index.encode(np.asarray(user_ids))
+        pos = self.matrix.item_index.encode(np.asarray(movie_ids))
+        out = np.zeros((len(u), len(pos)), dtype=np.float32)
+        known_u, known_i = np.flatnonzero(u >= 0), np.flatnonzero(pos >= 0)
+        out[:, known_i] = self._popularity[pos[known_i]]
+        if len(known_u):
+            out[np.ix_(known_u, known_i)] = self.score_block(u[known_u])[:, pos[known_i]]
+        return out
 
-        return float((neigh_ratings[mask] * neighbors[mask]).sum() / neighbors[mask].abs().sum())
+    def score_items(self, userId, movie_ids, profile=None):
+        """Scores for ``movie_ids`` in the given order (like predict).
 
-    def recommend(self, userId, movies, top_n=None):
-        if userId not in self.matrix.index:
-            return []
+        An unknown user with a ``(movie_ids, ratings)`` profile is scored by
+        fold-in (see profile_scores) instead of popularity.
+        """
+        scores = self.profile_scores(profile) if profile is not None and userId not in self.matrix.user_index else None
+        if scores is None:
+            return self.score_users([userId], movie_ids)[0]
+        pos = self.matrix.item_index.encode(np.asarray(movie_ids))
+        out = np.zeros(len(pos), dtype=np.float32)
+        out[pos >= 0] = scores[0][pos[pos >= 0]]
+        return out
+
+    def profile_scores(self, profile):
+        """Scores of every item for an ad-hoc user given as ``(movie_ids, ratings)``.
+
+        Returns ``(scores, rated positions)``, or None when no movie of the
+        profile is known. One sparse pass, fast enough to run inside a request.
+        """
+        movie_ids, ratings = profile
+        pos = self.matrix.item_index.encode(np.asarray(movie_ids))
+        known = pos >= 0
+        if not known.any():
+            return None
+        ratings = np.asarray(ratings, dtype=np.float32)[known]
+        row = build_csr(np.zeros(known.sum(), dtype=np.int32), pos[known], ratings, (1, self.matrix.shape[1]))
+        return self._fold_in(row, float(row.data.mean())), row.indices
+
+    def rank_many(self, user_ids, top_n=10, candidates=None, n_jobs=None):
+        """Batch rank(): top-N unseen movies for many users, scored in blocks on the worker pool.
+
+        Returns ``(user_ids, movie_ids, scores, totals)``: the known users, two
+        (users × top_n) arrays padded with movieId -1 / score NaN, and each
+        user's number of rankable movies.
+        """
+        user_ids = np.asarray(user_ids)
+        pos = self.matrix.user_index.encode(user_ids)
+        known = pos >= 0
+        allowed = None
+        if candidates is not None:
+            allowed = np.zeros(self.matrix.shape[1], dtype=bool)
+            cand = self.matrix.item_index.encode(np.asarray(candidates))
+            allowed[cand[cand >= 0]] = True
+        positions, scores, totals = top_n_for_users(
+            self.score_block,
+            pos[known],
+            top_n,
+            exclude=self.matrix.by_user,
+            allowed=allowed,
+            block_size=self.cfg.scoring_block_size,
+            n_jobs=n_jobs if n_jobs is not None else self.cfg.n_jobs,
+            backend=self.cfg.parallel_backend,
+        )
+        movie_ids = np.where(positions >= 0, self.matrix.item_ids[np.maximum(positions, 0)], -1)
+        return user_ids[known], movie_ids, scores, totals
+
+    def recommend_many(self, user_ids, top_n=10, n_jobs=None):
+        """Top-N unseen movies for many users: ``(user_ids, movie_ids, scores)`` as in rank_many."""
+        return self.rank_many(user_ids, top_n, n_jobs=n_jobs)[:3]
 
-        user_vector = self.matrix.loc[userId]
-        unseen = user_vector[user_vector == 0]
+    def rank(self, userId, top_n=None, candidates=None, profile=None):
+        """Top-``top_n`` unseen movies as ``(movie_ids, scores, total)``.
 
-        preds = [(movieId, self.predict(userId, movieId)) for movieId in unseen.index]
+        ``total`` is the number of rankable movies, so callers can tell whether a
+        bounded list can be extended. ``candidates`` restricts ranking to those movieIds.
+        Unknown users are ranked from ``profile`` (see profile_scores) or by popularity.
+        """
+        u = self.matrix.user_index.index(userId)
+        if u >= 0:
+            scores = self.score_block(np.array([u]))[0]
+            seen, _ = self.matrix.user_row(u)
+        else:
+            # user chưa có trong model: fold-in từ profile gửi kèm, không có thì theo độ phổ biến
+            folded = self.profile_scores(profile) if profile is not None else None
+            scores, seen = folded if folded is not None else (self._popularity, [])
+        if candidates is None:
+            allowed = np.ones(len(scores), dtype=bool)
+        else:
+            allowed = np.zeros(len(scores), dtype=bool)
+            pos = self.matrix.item_index.encode(np.asarray(candidates))
+            allowed[pos[pos >= 0]] = True
+        allowed[seen] = False
+        pool = np.flatnonzero(allowed)
 
-        preds = sorted(preds, key=lambda x: x[1], reverse=True)
-        if top_n is not None:
-            preds = preds[:top_n]
+        order = pool[top_n_indices(scores[pool], top_n)]
+        return self.matrix.item_index.decode(order), scores[order], len(pool)
+
+    def recommend(self, userId, movies, top_n=None):
+        movie_ids, scores, _ = self.rank(userId, top_n)
+        titles = as_metadata(movies).lookup(movie_ids)
 
         recs = []
-        for movieId, score in preds:
-            movie = movies.loc[movies["movieId"] == movieId]
-            meta = {"title": movie["title"].iloc[0]} if not movie.empty else None
-            recs.append(Recommendation(movieId, score, meta))
+        for movieId, score, title in zip(movie_ids, scores, titles):
+            meta = {"title": title} if title is not None else None
+            recs.append(Recommendation(int(movieId), float(score), meta))
 
         return recs
 
 
-class ItemBasedCF:
+class UserBasedCF(_NeighborhoodCF):
+    _scoring_matrices = ("_weights", "_abs_weights", "_rated")
+    _metric_name = "user_cf"
+    _normed = None   # row-normalized ratings for fold-in, built on first use
+
     def __init__(self, cfg=model_config):
-        self.k = cfg.item_based_neighbors
+        self.k = cfg.user_based_neighbors
+        self.block_size = cfg.similarity_block_size
+        self.cfg = cfg
 
     def fit(self, ratings):
-        matrix = ratings.pivot_table(index="movieId", columns="userId", values="rating").fillna(0)
-        print(f"[ItemCF] Building similarity: items={matrix.shape[0]}, users={matrix.shape[1]}, k={self.k}")
+        matrix = ratings if isinstance(ratings, RatingMatrix) else RatingMatrix.from_frame(ratings)
+        print(f"[UserCF] Building similarity: users={matrix.shape[0]}, items={matrix.shape[1]}, k={self.k}")
         self.matrix = matrix
-        self.similarity = pd.DataFrame(
-            cosine_similarity_manual(matrix.to_numpy()),
-            index=matrix.index,
-            columns=matrix.index,
-        )
-        print("[ItemCF] Similarity matrix computed")
+        with registry.timer("model_fit_seconds", model="user_cf", phase="neighbors"):
+            self.neighbors = build_neighbor_index(
+                matrix.by_user, self.k, self.block_size, self.cfg.n_jobs, self.cfg.parallel_backend
+            )
+        with registry.timer("model_fit_seconds", model="user_cf", phase="prepare"):
+            self._prepare_scoring()
+        print("[UserCF] Neighbor index computed")
         return self
 
-    def predict(self, userId, movieId):
-        if movieId not in self.matrix.index:
-            return 0
-        if userId not in self.matrix.columns:
-            return 0
+    def _update_neighbors(self, matrix, delta, user_remap, item_remap):
+        logger.info("[UserCF] Updating neighbors of %d users", len(delta.user_ids))
+        return update_neighbor_index(
+            self.neighbors, matrix.by_user, matrix.user_index.encode(delta.user_ids), user_remap,
+            self.block_size, self.cfg.n_jobs, self.cfg.parallel_backend,
+        )
 
-        sims = self.similarity.loc[movieId].drop(movieId, errors="ignore")
-        neighbors = sims.nlargest(self.k)
-        user_ratings = self.matrix.loc[neighbors.index, userId]
+    def _prepare_scoring(self):
+        n_users = self.matrix.shape[0]
+        self._weights = _neighbor_matrix(self.neighbors, n_users)
+        self._abs_weights = _neighbor_matrix(self.neighbors, n_users, absolute=True)
+        self._rated = binary_pattern(self.matrix.by_user)
+        self._user_means = self.matrix.user_means()
+        self._popularity = self.matrix.item_popularity(self.cfg.popularity_damping)
+        self._normed = None
 
-        mask = user_ratings > 0
-        if mask.sum() == 0:
-            user_history = self.matrix.loc[:, userId]
-            if (user_history > 0).sum() == 0:
-                return 0
-            return float(user_history.replace(0, np.nan).mean())
+    def _fold_in(self, row, fallback):
+        # neighbor tạm thời: k user có cosine cao nhất với vector rating gửi kèm
+        if self._normed is None:
+            self._normed = normalize_rows(self.matrix.by_user)
+        sims = (self._normed @ normalize_rows(row).T).toarray().ravel()
+        k = min(self.k, len(sims))
+        if k == 0:
+            return np.full(self.matrix.shape[1], fallback, dtype=np.float32)
+        top = np.argpartition(-sims, k - 1)[:k]
+        weights = sp.csr_matrix((sims[top], (np.zeros(k, dtype=np.int32), top)), shape=(1, len(sims)))
+        numer = (weights @ self.matrix.by_user).toarray()[0]
+        denom = (abs(weights) @ self._rated).toarray()[0]
+        return combine_weighted(numer, denom, fallback)
 
-        return float((user_ratings[mask] * neighbors[mask]).sum() / neighbors[mask].abs().sum())
+    def _predict_pairs(self, u, i):
+        neighbor_ids = self.neighbors.ids[u]
+        weights = self.neighbors.weights[u]
+        ratings = self.matrix.values_at(
+            np.where(neighbor_ids >= 0, neighbor_ids, 0),
+            np.repeat(i, neighbor_ids.shape[1]),
+        ).reshape(neighbor_ids.shape)
+        return _pairwise_scores(neighbor_ids, weights, ratings, self._user_means[u])
 
-    def recommend(self, userId, movies, top_n=None):
-        if userId not in self.matrix.columns:
-            return []
+    def score_block(self, user_positions):
+        """Scores of every item for a block of user positions, shape (len(block), n_items)."""
+        user_positions = np.asarray(user_positions)
+        numer = (self._weights[user_positions] @ self.matrix.by_user).toarray()
+        denom = (self._abs_weights[user_positions] @ self._rated).toarray()
+        return combine_weighted(numer, denom, self._user_means[user_positions][:, None])
 
-        user_vector = self.matrix.loc[:, userId]
-        unseen = user_vector[user_vector == 0]
 
-        preds = [(movieId, self.predict(userId, movieId)) for movieId in unseen.index]
-        preds = sorted(preds, key=lambda x: x[1], reverse=True)
-        if top_n is not None:
-            preds = preds[:top_n]
+class ItemBasedCF(_NeighborhoodCF):
+    _scoring_matrices = ("_weights_t", "_abs_weights_t", "_rated")
+    _metric_name = "item_cf"
 
-        recs = []
-        for movieId, score in preds:
-            movie = movies.loc[movies["movieId"] == movieId]
-            meta = {"title": movie["title"].iloc[0]} if not movie.empty else None
-            recs.append(Recommendation(movieId, score, meta))
+    def __init__(self, cfg=model_config):
+        self.k = cfg.item_based_neighbors
+        self.block_size = cfg.similarity_block_size
+        self.cfg = cfg
 
-        return recs
+    def fit(self, ratings):
+        matrix = ratings if isinstance(ratings, RatingMatrix) else RatingMatrix.from_frame(ratings)
+        print(f"[ItemCF] Building similarity: items={matrix.shape[1]}, users={matrix.shape[0]}, k={self.k}")
+        self.matrix = matrix
+        with registry.timer("model_fit_seconds", model="item_cf", phase="neighbors"):
+            self.neighbors = build_neighbor_index(
+                matrix.by_item, self.k, self.block_size, self.cfg.n_jobs, self.cfg.parallel_backend
+            )
+        with registry.timer("model_fit_seconds", model="item_cf", phase="prepare"):
+            self._prepare_scoring()
+        print("[ItemCF] Neighbor index computed")
+        return self
+
+    def _update_neighbors(self, matrix, delta, user_remap, item_remap):
+        logger.info("[ItemCF] Updating neighbors of %d items", len(delta.item_ids))
+        return update_neighbor_index(
+            self.neighbors, matrix.by_item, matrix.item_index.encode(delta.item_ids), item_remap,
+            self.block_size, self.cfg.n_jobs, self.cfg.parallel_backend,
+        )
+
+    def _prepare_scoring(self):
+        n_items = self.matrix.shape[1]
+        # chuyển vị sẵn: score[u, i] = sum_j R[u, j] * S[i, j]
+        self._weights_t = _neighbor_matrix(self.neighbors, n_items).T.tocsr()
+        self._abs_weights_t = _neighbor_matrix(self.neighbors, n_items, absolute=True).T.tocsr()
+        self._rated = binary_pattern(self.matrix.by_user)
+        self._user_means = self.matrix.user_means()
+        self._popularity = self.matrix.item_popularity(self.cfg.popularity_damping)
+
+    def _fold_in(self, row, fallback):
+        numer = (row @ self._weights_t).toarray()[0]
+        denom = (binary_pattern(row) @ self._abs_weights_t).toarray()[0]
+        return combine_weighted(numer, denom, fallback)
+
+    def _predict_pairs(self, u, i):
+        neighbor_ids = self.neighbors.ids[i]
+        weights = self.neighbors.weights[i]
+        ratings = self.matrix.values_at(
+            np.repeat(u, neighbor_ids.shape[1]),
+            np.where(neighbor_ids >= 0, neighbor_ids, 0),
+        ).reshape(neighbor_ids.shape)
+        return _pairwise_scores(neighbor_ids, weights, ratings, self._user_means[u])
+
+    def score_block(self, user_positions):
+        """Scores of every item for a block of user positions, shape (len(block), n_items)."""
+        user_positions = np.asarray(user_positions)
+        numer = (self.matrix.by_user[user_positions] @ self._weights_t).toarray()
+        denom = (self._rated[user_positions] @ self._abs_weights_t).toarray()
+        return combine_weighted(numer, denom, self._user_means[user_positions][:, None])
@@ -1,19 +1,13 @@
 # data_preprocessing.py
-import pandas as pd
+import numpy as np
 from config import data_config, model_config
+from src.ingestion import ingest_movies, ingest_ratings, iter_cached_rating_chunks
+from src.sparse_matrix import IdIndex, RatingMatrix, build_csr
 
-MAX_RATINGS = 1_000_000
 
 def load_datasets(cfg=data_config):
-    movies = pd.read_csv(cfg.movies_file)
-    ratings = pd.read_csv(cfg.ratings_file)
-    
-    if len(ratings) > MAX_RATINGS:
-        user1_rows = ratings[ratings["userId"] == 1]
-
-        ratings = ratings.sample(MAX_RATINGS, random_state=42)
-        
-        ratings = pd.concat([ratings, user1_rows]).drop_duplicates()
+    movies = ingest_movies(cfg)
+    ratings = ingest_ratings(cfg)
     return movies, ratings
 
 
@@ -39,10 +33,66 @@ def preprocess_pipeline():
     movies, ratings = load_datasets()
     movies, ratings = clean_data(movies, ratings)
     ratings = filter_interactions(ratings)
+    return movies, ratings
 
-    # Lưu dữ liệu đã xử lý
-    data_config.processed_dir.mkdir(parents=True, exist_ok=True)
-    movies.to_csv(data_config.processed_dir / "movies_processed.csv", index=False)
-    ratings.to_csv(data_config.processed_dir / "ratings_processed.csv", index=False)
 
-    return movies, ratings
+class _IdCounter:
+    """Running value_counts over chunks, memory O(distinct ids)."""
+
+    def __init__(self):
+        self.ids = np.zeros(0, dtype=np.int32)
+        self.counts = np.zeros(0, dtype=np.int64)
+
+    def add(self, values):
+        ids, counts = np.unique(values, return_counts=True)
+        merged, inverse = np.unique(np.concatenate([self.ids, ids]), return_inverse=True)
+        self.counts = np.bincount(inverse, weights=np.concatenate([self.counts, counts]), minlength=len(merged)).astype(np.int64)
+        self.ids = merged.astype(np.int32)
+
+    def at_least(self, n):
+        return self.ids[self.counts >= n]
+
+
+def build_rating_matrix(cfg=data_config, model_cfg=model_config):
+    """Cleaned + filtered ratings as a RatingMatrix, streamed in two passes over the column cache.
+
+    Pass 1 computes the filter_interactions counts; pass 2 keeps the rows that
+    pass the filter and encodes them straight into int32/float32 coordinates.
+    Only one chunk (sized by ``DataConfig.memory_budget_mb``) of raw rows is in
+    memory at a time, so the full dataset is used without subsampling.
+    """
+    user_counts, item_counts = _IdCounter(), _IdCounter()
+    for users, items, rates in iter_cached_rating_chunks(cfg):
+        valid = rates > 0
+        user_counts.add(users[valid])
+        item_counts.add(items[valid])
+
+    user_index = IdIndex(user_counts.at_least(model_cfg.min_interactions_user))
+    item_index = IdIndex(item_counts.at_least(model_cfg.min_interactions_item))
+
+    rows, cols, values = [], [], []
+    for users, items, rates in iter_cached_rating_chunks(cfg):
+        u = user_index.encode(users)
+        i = item_index.encode(items)
+        keep = (u >= 0) & (i >= 0) & (rates > 0)
+        rows.append(u[keep].astype(np.int32))
+        cols.append(i[keep].astype(np.int32))
+        values.append(rates[keep])
+
+    # user/phim còn lại sau khi lọc chéo có thể không còn rating nào -> thu gọn index
+    rows = np.concatenate(rows) if rows else np.zeros(0, np.int32)
+    cols = np.concatenate(cols) if cols else np.zeros(0, np.int32)
+    values = np.concatenate(values) if values else np.zeros(0, np.float32)
+    used_users = np.unique(rows)
+    used_items = np.unique(cols)
+    rows = np.searchsorted(used_users, rows).astype(np.int32)
+    cols = np.searchsorted(used_items, cols).astype(np.int32)
+
+    matrix = build_csr(rows, cols, values, (len(used_users), len(used_items)))
+    return RatingMatrix(matrix, IdIndex(user_index.ids[used_users]), IdIndex(item_index.ids[used_items]))
+
+
+def preprocess_pipeline_streaming(cfg=data_config, model_cfg=model_config):
+    """Like preprocess_pipeline but returns the ratings as a RatingMatrix built out of core."""
+    movies = ingest_movies(cfg).drop_duplicates(subset=["movieId"])
+    return movies, build_rating_matrix(cfg, model_cfg)
@@ -5,6 +5,7 @@ from typing import Dict, Iterable, List, Sequence, Tuple
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 
 def rmse_score(y_true, y_pred):
@@ -78,6 +79,14 @@ def catalog_coverage(recommendations: Dict[int, Sequence[str]], all_items: Itera
     return len(recommended_items) / len(catalog) if catalog else 0.0
 
 
+def _mean_pairwise_distance(vectors: np.ndarray) -> float:
+    # |a - b|² = |a|² + |b|² - 2 a·b: bộ nhớ O(n²) thay vì tensor O(n²·d)
+    sq = np.einsum("ij,ij->i", vectors, vectors)
+    d2 = sq[:, None] + sq[None, :] - 2.0 * (vectors @ vectors.T)
+    upper = d2[np.triu_indices(len(vectors), k=1)]
+    return float(np.mean(np.sqrt(np.maximum(upper, 0.0))))
+
+
 def diversity_score(
     recommendations: Dict[int, Sequence[str]],
     item_embeddings: pd.DataFrame,
@@ -86,11 +95,103 @@ def diversity_score(
     distances = []
     for recs in recommendations.values():
         embeddings = item_embeddings.reindex(recs).dropna()
-        vectors = embeddings.to_numpy()
+        vectors = embeddings.to_numpy(dtype=np.float64)
         if len(vectors) < 2:
             continue
-        norms = np.linalg.norm(vectors[:, None, :] - vectors[None, :, :], axis=-1)
-        upper = norms[np.triu_indices(len(vectors), k=1)]
-        if upper.size:
-            distances.append(float(np.mean(upper)))
+        distances.append(_mean_pairwise_distance(vectors))
     return float(np.mean(distances)) if distances else 0.0
+
+
+# ----- Vectorized metrics over padded arrays -----
+# ``recommended`` is a (users × k) array of item positions padded with -1 and
+# ``relevance`` a users × items CSR matrix whose stored values are the gains
+# of each user's relevant test items (same row order as ``recommended``).
+
+
+def _discounts(k: int) -> np.ndarray:
+    return 1.0 / np.log2(np.arange(k) + 2.0)
+
+
+def lookup_gains(recommended: np.ndarray, relevance: sparse.csr_matrix) -> np.ndarray:
+    """(users × k) gains of the recommended items, 0 for misses and padding."""
+    relevance = relevance.tocsr()
+    relevance.sort_indices()
+    if relevance.nnz == 0:
+        return np.zeros(recommended.shape, dtype=np.float64)
+    n_items = relevance.shape[1]
+    rows = np.repeat(np.arange(relevance.shape[0], dtype=np.int64), np.diff(relevance.indptr))
+    # khoá (user, item) của CSR đã sắp xếp tăng dần -> tra bằng searchsorted
+    keys = rows * n_items + relevance.indices
+    query = np.arange(len(recommended), dtype=np.int64)[:, None] * n_items + np.maximum(recommended, 0)
+    found = np.minimum(np.searchsorted(keys, query), len(keys) - 1)
+    hit = (recommended >= 0) & (keys[found] == query)
+    return np.where(hit, relevance.data[found], 0.0)
+
+
+def ideal_dcg(relevance: sparse.csr_matrix, k: int) -> np.ndarray:
+    """Best achievable DCG@k of every user: its ``k`` largest gains, sorted."""
+    relevance = relevance.tocsr()
+    counts = np.diff(relevance.indptr)
+    rows = np.repeat(np.arange(relevance.shape[0]), counts)
+    order = np.lexsort((-relevance.data, rows))
+    rank = np.arange(len(order)) - np.repeat(relevance.indptr[:-1], counts)
+    keep = rank < k
+    return np.bincount(
+        rows[keep], weights=relevance.data[order][keep] * _discounts(k)[rank[keep]], minlength=relevance.shape[0]
+    )
+
+
+def ranking_metrics(recommended: np.ndarray, relevance: sparse.csr_matrix, k: int = 10) -> Dict[str, float]:
+    """precision@k, recall@k and nDCG@k averaged over users with at least one relevant item.
+
+    Same definitions as precision_at_k / recall_at_k / ndcg_at_k, computed
+    with one hit mask and a log-discount table instead of per-user loops.
+    """
+    recommended = np.asarray(recommended)[:, :k]
+    gains = lookup_gains(recommended, relevance)
+    hits = (gains > 0).sum(axis=1)
+    n_recs = (recommended >= 0).sum(axis=1)
+    n_relevant = np.diff(relevance.tocsr().indptr)
+    users = n_relevant > 0
+
+    dcg = gains @ _discounts(recommended.shape[1]) if recommended.shape[1] else np.zeros(len(gains))
+    idcg = ideal_dcg(relevance, k)
+    scored = users & (idcg > 0)
+
+    def mean(values, mask):
+        return float(values[mask].mean()) if mask.any() else 0.0
+
+    return {
+        "precision": mean(hits / np.maximum(n_recs, 1), users),
+        "recall": mean(hits / np.maximum(n_relevant, 1), users),
+        "ndcg": mean(dcg / np.where(idcg > 0, idcg, 1.0), scored),
+        "users": int(users.sum()),
+    }
+
+
+def coverage_at_k(recommended: np.ndarray, n_items: int) -> float:
+    """Share of the catalog that appears in at least one top-k list."""
+    recommended = np.asarray(recommended)
+    return len(np.unique(recommended[recommended >= 0])) / n_items if n_items else 0.0
+
+
+def diversity_at_k(recommended: np.ndarray, item_vectors: np.ndarray, block_size: int = 1024) -> float:
+    """diversity_score over padded position arrays, a block of users at a time."""
+    recommended = np.asarray(recommended)
+    item_vectors = np.asarray(item_vectors, dtype=np.float64)
+    k = recommended.shape[1]
+    upper = np.triu(np.ones((k, k), dtype=bool), 1)
+    total, users = 0.0, 0
+    for start in range(0, len(recommended), block_size):
+        block = recommended[start:start + block_size]
+        valid = block >= 0
+        vectors = item_vectors[np.maximum(block, 0)]
+        sq = np.einsum("ukd,ukd->uk", vectors, vectors)
+        d2 = sq[:, :, None] + sq[:, None, :] - 2.0 * np.einsum("ukd,ujd->ukj", vectors, vectors)
+        pairs = valid[:, :, None] & valid[:, None, :] & upper
+        dist = np.where(pairs, np.sqrt(np.maximum(d2, 0.0)), 0.0).sum(axis=(1, 2))
+        n_pairs = pairs.sum(axis=(1, 2))
+        scored = n_pairs > 0
+        total += float((dist[scored] / n_pairs[scored]).sum())
+        users += int(scored.sum())
+    return total / users if users else 0.0
@@ -1,5 +1,29 @@
+from functools import partial
+
+import numpy as np
+
+from config import model_config
+from src.metadata import as_metadata
+from src.ranking import top_n_for_users, top_n_indices
+
+
+def normalize_scores(scores, method="none"):
+    """Put one model's scores on a comparable scale before fusion (per row for a 2-D block)."""
+    scores = np.asarray(scores, dtype=np.float64)
+    if method == "none" or scores.size == 0:
+        return scores
+    if method == "minmax":
+        lo = scores.min(axis=-1, keepdims=True)
+        span = scores.max(axis=-1, keepdims=True) - lo
+        return np.divide(scores - lo, span, out=np.zeros_like(scores), where=span > 0)
+    if method == "zscore":
+        std = scores.std(axis=-1, keepdims=True)
+        return np.divide(scores - scores.mean(axis=-1, keepdims=True), std, out=np.zeros_like(scores), where=std > 0)
+    raise ValueError(f"Unknown normalization: {method}")
+
+
 class HybridRecommender:
-    def __init__(self, user_cf, mf, w_cf=0.5, w_mf=0.5):
+    def __init__(self, user_cf, mf, w_cf=0.5, w_mf=0.5, normalization=None):
         # CF có thể None
         self.user_cf = user_cf
 
@@ -10,43 +34,96 @@ class HybridRecommender:
         self.w_cf = w_cf
         self.w_mf = w_mf
 
-    def recommend(self, userId, movies, top_n=10):
-        all_movieIds = movies["movieId"].tolist()
-        scores = []
+        self.normalization = normalization or model_config.hybrid_normalization
+
+    def _components(self):
+        components = []
+        if self.user_cf is not None:
+            components.append((self.user_cf, self.w_cf))
+        components.append((self.mf, self.w_mf))
+        return components
+
+    def score_users(self, user_ids, movie_ids):
+        """(users × movies) fused scores: sum of weighted, per-user normalized component scores."""
+        final = np.zeros((len(user_ids), len(movie_ids)), dtype=np.float64)
+        for model, weight in self._components():
+            if weight == 0:
+                continue
+            scores = model.score_users(user_ids, movie_ids)
+            final += weight * normalize_scores(scores, self.normalization)
+        return final
 
-        for movieId in all_movieIds:
+    def score_items(self, userId, movie_ids, profile=None):
+        """Fused score of every movie in ``movie_ids``: sum of weighted, normalized component scores.
 
-            # ----- CF score -----
-            if self.user_cf is not None:
-                try:
-                    cf_score = self.user_cf.predict(userId, movieId)
-                except Exception:
-                    cf_score = 0
-            else:
-                cf_score = 0
+        ``profile`` (``(movie_ids, ratings)``) is folded in by each component for unknown users.
+        """
+        if profile is None:
+            return self.score_users([userId], movie_ids)[0]
+        final = np.zeros(len(movie_ids), dtype=np.float64)
+        for model, weight in self._components():
+            if weight == 0:
+                continue
+            scores = model.score_items(userId, movie_ids, profile)
+            final += weight * normalize_scores(scores, self.normalization)
+        return final
 
-            # ----- MF score (luôn có) -----
-            mf_score = self.mf.predict(userId, movieId)
+    def _score_rows(self, user_ids, movie_ids, rows):
+        return self.score_users(user_ids[rows], movie_ids)
 
-            # ----- Hybrid -----
-            final = cf_score * self.w_cf + mf_score * self.w_mf
+    def rank_many(self, user_ids, movies, top_n=10, candidates=None, n_jobs=None):
+        """Batch rank() for many users (unknown users included), in blocks on the worker pool.
 
-            scores.append((movieId, final))
+        Returns ``(user_ids, movie_ids, scores, totals)`` like the component models.
+        """
+        user_ids = np.asarray(user_ids)
+        catalog = as_metadata(movies).movie_ids
+        allowed = np.isin(catalog, candidates) if candidates is not None else None
+        positions, scores, totals = top_n_for_users(
+            partial(self._score_rows, user_ids, catalog),
+            np.arange(len(user_ids)),
+            top_n,
+            allowed=allowed,
+            block_size=self.mf.cfg.scoring_block_size,
+            n_jobs=n_jobs if n_jobs is not None else self.mf.cfg.n_jobs,
+            backend=self.mf.cfg.parallel_backend,
+        )
+        movie_ids = np.where(positions >= 0, catalog[np.maximum(positions, 0)], -1)
+        return user_ids, movie_ids, scores, totals
 
-        # Sắp xếp theo điểm
-        scores = sorted(scores, key=lambda x: x[1], reverse=True)
-        if top_n is not None:
-            scores = scores[:top_n]
+    def rank(self, userId, movies, top_n=10, candidates=None, profile=None):
+        """Top-``top_n`` of the catalog as ``(movie_ids, scores, total)``.
+
+        Scores are always normalized over the whole catalog; ``candidates`` only
+        restricts which movieIds are ranked. Movies of a ``profile`` are left out.
+        """
+        movie_ids = as_metadata(movies).movie_ids
+        scores = self.score_items(userId, movie_ids, profile)
+        keep = None
+        if candidates is not None:
+            keep = np.isin(movie_ids, candidates)
+        if profile is not None:
+            # phim user vừa gửi rating thì không gợi ý lại
+            unseen = ~np.isin(movie_ids, profile[0])
+            keep = unseen if keep is None else keep & unseen
+        if keep is not None:
+            movie_ids, scores = movie_ids[keep], scores[keep]
+        order = top_n_indices(scores, top_n)
+        return movie_ids[order], scores[order], len(movie_ids)
+
+    def recommend(self, userId, movies, top_n=10):
+        metadata = as_metadata(movies)
+        movie_ids, scores, _ = self.rank(userId, metadata, top_n)
+        titles = metadata.lookup(movie_ids)
 
         # Build output
         results = []
-        for movieId, score in scores:
-            row = movies.loc[movies["movieId"] == movieId].iloc[0]
+        for movieId, score, title in zip(movie_ids, scores, titles):
             results.append({
-                "movieId": movieId,
-                "title": row["title"],
+                "movieId": int(movieId),
+                "title": title,
                 "score": float(score),
-                "metadata": {"title": row["title"]},
+                "metadata": {"title": title},
             })
 
         return results
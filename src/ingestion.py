@@ -0,0 +1,161 @@
+# ingestion.py
+"""Typed, chunked CSV ingestion with a binary columnar cache.
+
+The first run parses ``movies.csv`` / ``ratings.csv`` with compact dtypes
+(int32 ids, float32 ratings) in chunks and stores every column as ``.npy``
+under ``DataConfig.columns_dir``. Later runs load (or stream) those columns
+directly as long as the source file's size and mtime are unchanged. Chunk
+sizes follow ``DataConfig.memory_budget_mb``.
+"""
+import pathlib
+
+import numpy as np
+import pandas as pd
+
+from config import data_config
+from src.artifacts import StringColumn, encode_strings, load_arrays, save_arrays
+
+# Nullable ints while parsing so rows with missing ids can be dropped per chunk
+RATING_DTYPES = {"userId": "Int32", "movieId": "Int32", "rating": np.float32}
+MOVIE_DTYPES = {"movieId": "Int32", "title": str, "genres": str}
+
+CACHE_VERSION = 1
+
+# Rough working-set bytes per parsed rating row (pandas parsing + int/float temporaries)
+BYTES_PER_ROW = 128
+
+
+def _source_stamp(path):
+    stat = pathlib.Path(path).stat()
+    return {"source": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "version": CACHE_VERSION}
+
+
+def _cache_is_fresh(cache_dir, stamp):
+    try:
+        _, meta = load_arrays(cache_dir, mmap_mode="r")
+    except (OSError, ValueError):
+        return False
+    return meta == stamp
+
+
+def iter_rating_chunks(path, chunksize):
+    """Yield (userId int32, movieId int32, rating float32) array triples, ``chunksize`` rows at a time."""
+    reader = pd.read_csv(
+        path,
+        usecols=list(RATING_DTYPES),
+        dtype=RATING_DTYPES,
+        chunksize=chunksize,
+    )
+    for chunk in reader:
+        chunk = chunk.dropna(subset=["userId", "movieId"])
+        yield (
+            chunk["userId"].to_numpy(dtype=np.int32),
+            chunk["movieId"].to_numpy(dtype=np.int32),
+            chunk["rating"].to_numpy(dtype=np.float32),
+        )
+
+
+class _ColumnWriter:
+    """Append array chunks to a raw temp file, then turn it into a ``.npy`` without holding it in memory."""
+
+    def __init__(self, path, dtype, copy_rows):
+        self.path = pathlib.Path(path)
+        self.dtype = np.dtype(dtype)
+        self.copy_rows = copy_rows
+        self.tmp = self.path.with_suffix(".part")
+        self.fh = open(self.tmp, "wb")
+        self.n = 0
+
+    def append(self, values):
+        np.asarray(values, dtype=self.dtype).tofile(self.fh)
+        self.n += len(values)
+
+    def finish(self):
+        self.fh.close()
+        out = np.lib.format.open_memmap(self.path, mode="w+", dtype=self.dtype, shape=(self.n,))
+        for start in range(0, self.n, self.copy_rows):
+            count = min(self.copy_rows, self.n - start)
+            out[start:start + count] = np.fromfile(
+                self.tmp, dtype=self.dtype, count=count, offset=start * self.dtype.itemsize
+            )
+        out.flush()
+        del out
+        self.tmp.unlink()
+
+
+def chunk_rows(cfg=data_config):
+    """Rows per streamed chunk so one chunk's working set stays within ``cfg.memory_budget_mb``."""
+    return max(10_000, cfg.memory_budget_mb * 2**20 // BYTES_PER_ROW)
+
+
+def ensure_ratings_cache(cfg=data_config):
+    """Build the ratings column cache if it is missing or stale; returns its directory.
+
+    The CSV is streamed chunk by chunk straight to disk, so peak memory is
+    bounded by the chunk size rather than by the file size.
+    """
+    cache_dir = cfg.columns_dir / "ratings"
+    stamp = _source_stamp(cfg.ratings_file)
+    if _cache_is_fresh(cache_dir, stamp):
+        return cache_dir
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    (cache_dir / "meta.json").unlink(missing_ok=True)
+    rows = chunk_rows(cfg)
+    writers = {
+        "userId": _ColumnWriter(cache_dir / "userId.npy", np.int32, rows),
+        "movieId": _ColumnWriter(cache_dir / "movieId.npy", np.int32, rows),
+        "rating": _ColumnWriter(cache_dir / "rating.npy", np.float32, rows),
+    }
+    for u, i, r in iter_rating_chunks(cfg.ratings_file, rows):
+        writers["userId"].append(u)
+        writers["movieId"].append(i)
+        writers["rating"].append(r)
+    for writer in writers.values():
+        writer.finish()
+    # meta.json ghi sau cùng: cache chỉ hợp lệ khi mọi cột đã ghi xong
+    save_arrays(cache_dir, {}, stamp)
+    return cache_dir
+
+
+def iter_cached_rating_chunks(cfg=data_config):
+    """Yield (userId, movieId, rating) chunks from the memory-mapped column cache."""
+    arrays, _ = load_arrays(ensure_ratings_cache(cfg), mmap_mode="r")
+    n = len(arrays["rating"])
+    rows = chunk_rows(cfg)
+    for start in range(0, n, rows):
+        end = min(start + rows, n)
+        yield (
+            np.asarray(arrays["userId"][start:end]),
+            np.asarray(arrays["movieId"][start:end]),
+            np.asarray(arrays["rating"][start:end]),
+        )
+
+
+def ingest_ratings(cfg=data_config):
+    """All ratings as a compact DataFrame, from the columnar cache."""
+    arrays, _ = load_arrays(ensure_ratings_cache(cfg))
+    return pd.DataFrame({name: arrays[name] for name in ("userId", "movieId", "rating")})
+
+
+def ingest_movies(cfg=data_config):
+    """Movies as a DataFrame (int32 movieId, title, genres), from the columnar cache when it is fresh."""
+    cache_dir = cfg.columns_dir / "movies"
+    stamp = _source_stamp(cfg.movies_file)
+    if not _cache_is_fresh(cache_dir, stamp):
+        parts = []
+        for chunk in pd.read_csv(cfg.movies_file, dtype=MOVIE_DTYPES, chunksize=chunk_rows(cfg)):
+            parts.append(chunk.dropna(subset=["movieId"]))
+        movies = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=list(MOVIE_DTYPES))
+
+        arrays = {"movieId": movies["movieId"].to_numpy(dtype=np.int32)}
+        for column in ("title", "genres"):
+            values = movies[column].fillna("").tolist() if column in movies else [""] * len(movies)
+            arrays[f"{column}_blob"], arrays[f"{column}_offsets"] = encode_strings(values)
+        save_arrays(cache_dir, arrays, stamp)
+
+    arrays, _ = load_arrays(cache_dir)
+    data = {"movieId": arrays["movieId"]}
+    for column in ("title", "genres"):
+        data[column] = list(StringColumn(arrays[f"{column}_blob"], arrays[f"{column}_offsets"]))
+    return pd.DataFrame(data)
@@ -1,86 +1,316 @@
+import itertools
+import logging
+import pathlib
+
 import numpy as np
 from dataclasses import dataclass, field
 from config import ModelConfig, model_config
+from src.artifacts import load_arrays, save_arrays
+from src.metadata import as_metadata
+from src.metrics import registry
+from src.mf_training import fold_in, ridge_solve, train_factors
+from src.mips import InnerProductIndex, recall_at_n
+from src.ranking import top_n_for_users, top_n_indices
+from src.sparse_matrix import IdIndex, RatingMatrix
+
+logger = logging.getLogger(__name__)
+
+
+def _grow_rows(factors, remap, n_rows, rng):
+    """Copy of ``factors`` with rows moved to ``remap`` and fresh random rows for new ids."""
+    out = rng.normal(scale=0.1, size=(n_rows, factors.shape[1])).astype(np.float32)
+    out[remap] = factors
+    return out
 
 
 @dataclass
 class MFRecommender:
     cfg: ModelConfig = field(default_factory=lambda: model_config)
+    item_search = None   # InnerProductIndex over Q, built by fit()
+    _searches = None     # đếm số lần tìm IVF để lấy mẫu recall (xem _sample_recall)
 
     def fit(self, ratings):
+        """Train on a ratings DataFrame or a prebuilt RatingMatrix."""
+        matrix = ratings if isinstance(ratings, RatingMatrix) else RatingMatrix.from_frame(ratings)
+
+        # Dense id <-> row encoders: P/Q only hold rows for ids seen in training
+        self.user_index = matrix.user_index
+        self.item_index = matrix.item_index
+
         # Normalize ratings to avoid overflow during training
-        ratings = ratings.copy()
-        ratings["rating"] = ratings["rating"].astype(float)
-        ratings["rating"] /= ratings["rating"].max()
+        users, items, rates = matrix.coo()
+        self.rating_scale = float(rates.max()) if len(rates) else 1.0
+        rates = rates / np.float32(self.rating_scale)
 
-        users = ratings["userId"].astype(int).values
-        items = ratings["movieId"].astype(int).values
-        rates = ratings["rating"].astype(float).values
+        n_users = len(self.user_index)
+        n_items = len(self.item_index)
 
-        n_users = users.max() + 1
-        n_items = items.max() + 1
+        # Fallback score for users / movies without trained factors
+        self.global_mean = float(rates.mean()) if len(rates) else 0.0
+        # Fallback ranking for unknown users: damped mean rating of each movie
+        self.popularity = matrix.item_popularity(self.cfg.popularity_damping) / np.float32(self.rating_scale)
 
         # Latent factors matrices
-        self.P = np.random.normal(scale=0.1, size=(n_users, self.cfg.latent_factors))
-        self.Q = np.random.normal(scale=0.1, size=(n_items, self.cfg.latent_factors))
+        self.P = np.random.normal(scale=0.1, size=(n_users, self.cfg.latent_factors)).astype(np.float32)
+        self.Q = np.random.normal(scale=0.1, size=(n_items, self.cfg.latent_factors)).astype(np.float32)
 
         print(
             f"[MF] Start training: users={n_users}, items={n_items}, "
-            f"factors={self.cfg.latent_factors}, epochs={self.cfg.epochs}"
+            f"factors={self.cfg.latent_factors}, epochs={self.cfg.epochs}, solver={self.cfg.mf_solver}"
         )
-        lr = self.cfg.learning_rate
-        reg = self.cfg.reg
-        batch = 8192  # mini-batch size
+        with registry.timer("model_fit_seconds", model="mf", phase="train"):
+            self.P, self.Q, self.history = train_factors(self.P, self.Q, users, items, rates, self.cfg)
+        with registry.timer("model_fit_seconds", model="mf", phase="index"):
+            self.item_search = self._build_item_search()
 
-        for epoch in range(self.cfg.epochs):
-            idx = np.random.permutation(len(rates))
+        print("[MF] Training completed")
+        return self
 
-            for start in range(0, len(rates), batch):
-                end = start + batch
-                batch_idx = idx[start:end]
+    def partial_fit(self, new_ratings):
+        """Fold new ratings (DataFrame or RatingMatrix) into the trained factors.
 
-                u = users[batch_idx]
-                i = items[batch_idx]
-                r = rates[batch_idx]
+        New users / movies get factor rows solved against the existing ones,
+        then a few SGD epochs run over the new ratings. P and Q are replaced
+        by updated copies (never written in place), so a ``copy.copy`` of the
+        model can be updated while the original keeps serving.
+        """
+        delta = new_ratings if isinstance(new_ratings, RatingMatrix) else RatingMatrix.from_frame(new_ratings)
+        user_index, user_remap = self.user_index.union(delta.user_ids)
+        item_index, item_remap = self.item_index.union(delta.item_ids)
+        rng = np.random.default_rng()
+        P = _grow_rows(self.P, user_remap, len(user_index), rng)
+        Q = _grow_rows(self.Q, item_remap, len(item_index), rng)
 
-                preds = np.sum(self.P[u] * self.Q[i], axis=1)
-                err = r - preds
+        rows, cols, rates = delta.coo()
+        users = user_index.encode(delta.user_ids)[rows]
+        items = item_index.encode(delta.item_ids)[cols]
+        new_users = np.setdiff1d(np.arange(len(user_index)), user_remap)
+        new_items = np.setdiff1d(np.arange(len(item_index)), item_remap)
+        # chạy trong thread cập nhật của web server -> dùng logging thay vì print
+        logger.info(
+            "[MF] partial_fit: ratings=%d, new users=%d, new items=%d, epochs=%d",
+            len(rates), len(new_users), len(new_items), self.cfg.partial_fit_epochs,
+        )
+        with registry.timer("model_fit_seconds", model="mf", phase="partial_fit"):
+            self.P, self.Q = fold_in(
+                P, Q, users, items, rates / np.float32(self.rating_scale), new_users, new_items, self.cfg, rng
+            )
+        popularity = np.full(len(item_index), self.global_mean, dtype=np.float32)
+        popularity[item_remap] = self.popularity
+        self.popularity = popularity
+        self.user_index, self.item_index = user_index, item_index
+        self.item_search = self._build_item_search(log=logger.info)
+        return self
 
-                dP = (err[:, None] * self.Q[i]) - reg * self.P[u]
-                dQ = (err[:, None] * self.P[u]) - reg * self.Q[i]
+    def _build_item_search(self, log=print):
+        """IVF inner-product index over Q for sub-linear top-N, or None to scan every movie."""
+        if self.cfg.mf_index not in ("ivf", "exact"):
+            raise ValueError(f"Unknown MF index: {self.cfg.mf_index}")
+        if self.cfg.mf_index == "exact" or len(self.Q) < self.cfg.ann_min_items:
+            return None
 
-                self.P[u] += lr * dP
-                self.Q[i] += lr * dQ
+        index = InnerProductIndex.build(self.Q, self.cfg.ann_lists or None, self.cfg.ann_probe)
+        # recall@10 so với quét toàn bộ, trên một mẫu user
+        rng = np.random.default_rng(0)
+        sample = self.P[rng.choice(len(self.P), min(len(self.P), 200), replace=False)]
+        log(
+            f"[MF] IVF index: lists={index.n_lists}, probe={index.n_probe}, "
+            f"recall@10={recall_at_n(index, sample, 10):.3f}"
+        )
+        return index
 
-            print(f"[MF] Epoch {epoch+1}/{self.cfg.epochs} done")
+    def save(self, path):
+        save_arrays(
+            path,
+            {
+                "P": self.P,
+                "Q": self.Q,
+                "user_ids": self.user_index.ids,
+                "item_ids": self.item_index.ids,
+                "popularity": self.popularity,
+            },
+            {"global_mean": self.global_mean, "rating_scale": self.rating_scale, "history": self.history},
+        )
+        if self.item_search is not None:
+            self.item_search.save(pathlib.Path(path) / "index")
 
-        print("[MF] Training completed")
-        return self
+    @classmethod
+    def load(cls, path, cfg=None, mmap_mode=None):
+        arrays, meta = load_arrays(path, mmap_mode)
+        model = cls(cfg=cfg or model_config)
+        model.P, model.Q = arrays["P"], arrays["Q"]
+        model.user_index = IdIndex(arrays["user_ids"])
+        model.item_index = IdIndex(arrays["item_ids"])
+        model.global_mean = meta["global_mean"]
+        model.rating_scale = meta["rating_scale"]
+        model.history = meta.get("history", [])
+        model.popularity = arrays.get("popularity")
+        if model.popularity is None:
+            model.popularity = np.full(len(model.item_index), model.global_mean, dtype=np.float32)
+        index_path = pathlib.Path(path) / "index"
+        model.item_search = InnerProductIndex.load(index_path, mmap_mode) if index_path.exists() else None
+        if model.item_search is not None:
+            # số list dò là thiết lập lúc chạy, không nằm trong fingerprint của artifact
+            model.item_search.n_probe = model.cfg.ann_probe
+        return model
 
     def predict(self, userId, itemId):
-        if userId >= len(self.P) or itemId >= len(self.Q):
-            return 0
-        return np.dot(self.P[userId], self.Q[itemId])
+        u = self.user_index.index(userId)
+        i = self.item_index.index(itemId)
+        if i < 0:
+            return self.global_mean
+        if u < 0:
+            return float(self.popularity[i])
+        return float(np.dot(self.P[u], self.Q[i]))
 
-    def recommend(self, userId, candidate_items, top_n=10, movies=None):
-        scores = []
+    def fold_in_user(self, profile):
+        """Factor vector for an ad-hoc user from ``(movie_ids, ratings)``, solved against the fixed Q.
 
-        for m in candidate_items:
-            if m < len(self.Q):
-                score = self.predict(userId, m)
-                scores.append((m, score))
+        One ridge solve of size ``latent_factors``, cheap enough to run inside a
+        request. None when none of the movies has trained factors.
+        """
+        movie_ids, ratings = profile
+        pos = self.item_index.encode(np.asarray(movie_ids))
+        known = pos >= 0
+        if not known.any():
+            return None
+        rates = np.asarray(ratings, dtype=np.float64)[known] / self.rating_scale
+        return ridge_solve(self.Q[pos[known]], rates, self.cfg.reg).astype(np.float32)
 
-        scores = sorted(scores, key=lambda x: x[1], reverse=True)
-        if top_n is not None:
-            scores = scores[:top_n]
+    def score_users(self, user_ids, movie_ids):
+        """(users × movies) matrix of predict(): ``global_mean`` for unknown movies, popularity for unknown users."""
+        u = self.user_index.encode(np.asarray(user_ids))
+        pos = self.item_index.encode(np.asarray(movie_ids))
+        out = np.full((len(u), len(pos)), self.global_mean, dtype=np.float64)
+        known_u, known_i = np.flatnonzero(u >= 0), np.flatnonzero(pos >= 0)
+        out[:, known_i] = self.popularity[pos[known_i]]
+        if len(known_u):
+            out[np.ix_(known_u, known_i)] = self.P[u[known_u]] @ self.Q[pos[known_i]].T
+        return out
 
-        output = []
-        for mid, sc in scores:
-            meta = movies[movies["movieId"] == mid] if movies is not None else None
-            title = meta.iloc[0]["title"] if meta is not None and len(meta) else None
+    def score_items(self, userId, movie_ids, profile=None):
+        """Vectorized predict() over ``movie_ids``.
 
+        An unknown user with a ``(movie_ids, ratings)`` profile is scored with
+        a folded-in vector; without one, movies score by popularity.
+        """
+        vector = self.fold_in_user(profile) if profile is not None and userId not in self.user_index else None
+        if vector is None:
+            return self.score_users([userId], movie_ids)[0]
+        pos = self.item_index.encode(np.asarray(movie_ids))
+        out = np.full(len(pos), self.global_mean, dtype=np.float64)
+        known = pos >= 0
+        out[known] = self.Q[pos[known]] @ vector
+        return out
+
+    def score_block(self, user_positions):
+        """Scores of every trained movie for a block of user positions: P[block] @ Q^T."""
+        return self.P[np.asarray(user_positions)] @ self.Q.T
+
+    def rank_many(self, user_ids, top_n=10, candidate_items=None, n_jobs=None):
+        """Batch rank() for many users, in blocks on the worker pool.
+
+        Returns ``(user_ids, movie_ids, scores, totals)`` for the known users,
+        padded with -1 / NaN; ``totals`` counts each user's rankable movies.
+        """
+        user_ids = np.asarray(user_ids)
+        pos = self.user_index.encode(user_ids)
+        known = pos >= 0
+        allowed = None
+        if candidate_items is not None:
+            allowed = np.zeros(len(self.item_index), dtype=bool)
+            cand = self.item_index.encode(np.asarray(candidate_items))
+            allowed[cand[cand >= 0]] = True
+        positions, scores, totals = top_n_for_users(
+            self.score_block,
+            pos[known],
+            top_n,
+            allowed=allowed,
+            block_size=self.cfg.scoring_block_size,
+            n_jobs=n_jobs if n_jobs is not None else self.cfg.n_jobs,
+            backend=self.cfg.parallel_backend,
+        )
+        movie_ids = np.where(positions >= 0, self.item_index.ids[np.maximum(positions, 0)], -1)
+        return user_ids[known], movie_ids, scores, totals
+
+    def recommend_many(self, user_ids, top_n=10, n_jobs=None):
+        """Top-N movies for many users (like recommend over the whole catalog): ``(user_ids, movie_ids, scores)``."""
+        return self.rank_many(user_ids, top_n, n_jobs=n_jobs)[:3]
+
+    def rank(self, userId, top_n=10, candidate_items=None, profile=None, exact=False):
+        """Top-``top_n`` of ``candidate_items`` (default: every trained movie) as ``(movie_ids, scores, total)``.
+
+        Unknown users are ranked from their folded-in ``profile`` (see
+        score_items), without the profile's own movies, or by popularity. Over
+        the whole catalog the top-N of a user vector comes from the IVF index
+        (when built) instead of scoring every movie; ``exact=True`` scans
+        every movie, giving the same list as rank_many.
+        """
+        u = self.user_index.index(userId)
+        seen = None
+        if u >= 0:
+            vector = self.P[u]
+        else:
+            vector = self.fold_in_user(profile) if profile is not None else None
+            if vector is not None:
+                # phim trong profile là phim user đã xem -> không gợi ý lại (như fold-in của CF)
+                seen = self.item_index.encode(np.asarray(profile[0]))
+                seen = np.unique(seen[seen >= 0])
+        use_index = not exact and self.item_search is not None
+        if candidate_items is None and top_n is not None and vector is not None and use_index:
+            n_seen = 0 if seen is None else len(seen)
+            positions, scores = self.item_search.search(vector, top_n + n_seen)
+            self._sample_recall(vector, positions)
+            if n_seen:
+                keep = ~np.isin(positions, seen)
+                positions, scores = positions[keep][:top_n], scores[keep][:top_n]
+            return self.item_index.ids[positions], scores, len(self.item_index) - n_seen
+
+        if candidate_items is None:
+            candidate_items = self.item_index.ids
+        else:
+            candidate_items = np.asarray(candidate_items)
+            # Phim không có trong tập huấn luyện thì không có vector Q -> bỏ qua
+            candidate_items = candidate_items[self.item_index.encode(candidate_items) >= 0]
+        if seen is not None:
+            candidate_items = candidate_items[~np.isin(self.item_index.encode(candidate_items), seen)]
+
+        if vector is None:
+            scores = self.score_items(userId, candidate_items)
+        else:
+            scores = self.Q[self.item_index.encode(candidate_items)] @ vector
+        order = top_n_indices(scores, top_n)
+        return candidate_items[order], scores[order], len(candidate_items)
+
+    def _sample_recall(self, vector, positions):
+        """Every ``ann_recall_sample``-th IVF search, count its overlap with an exact scan.
+
+        recall = mf_ivf_recall_hits_total / mf_ivf_recall_expected_total, so
+        the index keeps being monitored after the one-off check in fit().
+        """
+        every = self.cfg.ann_recall_sample
+        if not every or not registry.enabled:
+            return
+        if self._searches is None:
+            self._searches = itertools.count()
+        if next(self._searches) % every:
+            return
+        exact, _ = self.item_search.search_exact(vector, len(positions))
+        hits = len(np.intersect1d(positions, exact))
+        registry.inc("mf_ivf_recall_hits_total", hits)
+        registry.inc("mf_ivf_recall_expected_total", len(exact))
+        registry.set_gauge("mf_ivf_recall_last", hits / max(len(exact), 1))
+
+    def recommend(self, userId, candidate_items, top_n=10, movies=None):
+        movie_ids, scores, _ = self.rank(userId, top_n, candidate_items)
+
+        metadata = as_metadata(movies)
+        titles = metadata.lookup(movie_ids) if metadata is not None else [None] * len(movie_ids)
+
+        output = []
+        for mid, sc, title in zip(movie_ids, scores, titles):
             output.append({
-                "movieId": mid,
+                "movieId": int(mid),
                 "score": float(sc),
                 "title": title,
                 "metadata": {"title": title} if title else None,
@@ -0,0 +1,82 @@
+# metadata.py
+import re
+
+import numpy as np
+from src.artifacts import StringColumn, encode_strings, load_arrays, save_arrays
+from src.sparse_matrix import IdIndex
+
+
+class MovieMetadata:
+    """Movie titles indexed by movieId, built once and shared by every recommender."""
+
+    def __init__(self, movie_ids, titles):
+        movie_ids = np.asarray(movie_ids)
+        order = np.argsort(movie_ids, kind="stable")
+        self.index = IdIndex(movie_ids[order])
+        self.titles = np.asarray(titles, dtype=object)[order]
+        self._search_text = None
+
+    @classmethod
+    def from_movies(cls, movies):
+        movies = movies.drop_duplicates(subset=["movieId"])
+        return cls(movies["movieId"].to_numpy(), movies["title"].to_numpy())
+
+    def save(self, path):
+        blob, offsets = encode_strings(self.titles)
+        save_arrays(path, {"movie_ids": self.movie_ids, "title_blob": blob, "title_offsets": offsets})
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays, _ = load_arrays(path, mmap_mode)
+        # đã được sắp xếp khi lưu -> dùng trực tiếp, tiêu đề chỉ giải mã khi tra cứu
+        metadata = cls.__new__(cls)
+        metadata.index = IdIndex(arrays["movie_ids"])
+        metadata.titles = StringColumn(arrays["title_blob"], arrays["title_offsets"])
+        metadata._search_text = None
+        return metadata
+
+    def __len__(self):
+        return len(self.index)
+
+    @property
+    def movie_ids(self):
+        return self.index.ids
+
+    def lookup(self, movie_ids):
+        """Titles for ``movie_ids`` in the given order, None for unknown movies."""
+        pos = self.index.encode(np.asarray(movie_ids))
+        titles = self.titles[np.maximum(pos, 0)] if len(self.titles) else [None] * len(pos)
+        return [t if p >= 0 else None for p, t in zip(pos, titles)]
+
+    def title(self, movie_id):
+        return self.lookup([movie_id])[0]
+
+    def _search_index(self):
+        # một chuỗi lowercase nối mọi tiêu đề + offset từng dòng, dựng một lần khi search lần đầu
+        if self._search_text is None:
+            lowered = [("" if t is None else str(t)).lower() for t in self.titles]
+            starts = np.zeros(len(lowered), dtype=np.int64)
+            if lowered:
+                starts[1:] = np.cumsum([len(t) + 1 for t in lowered[:-1]])
+            id_text = np.array([str(m) for m in self.movie_ids], dtype=str)
+            self._search_text = ("\n".join(lowered), starts, id_text)
+        return self._search_text
+
+    def search(self, query):
+        """Sorted movieIds whose title (case-insensitive) or id contains ``query``."""
+        q = query.lower()
+        if not q:
+            return self.movie_ids
+        text, starts, id_text = self._search_index()
+        hits = np.fromiter((m.start() for m in re.finditer(re.escape(q), text)), dtype=np.int64)
+        rows = np.zeros(len(self), dtype=bool)
+        rows[np.searchsorted(starts, hits, side="right") - 1] = True
+        rows |= np.char.find(id_text, q) >= 0
+        return self.movie_ids[rows]
+
+
+def as_metadata(movies):
+    """Accept either a MovieMetadata or a raw movies DataFrame."""
+    if movies is None or isinstance(movies, MovieMetadata):
+        return movies
+    return MovieMetadata.from_movies(movies)
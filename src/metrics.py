@@ -0,0 +1,178 @@
+# metrics.py
+"""In-process counters, gauges and latency histograms, exported in Prometheus text format.
+
+Usage::
+
+    from src.metrics import registry
+
+    with registry.timer("model_fit_seconds", model="mf", phase="train"):
+        ...
+    registry.inc("recommendations_total", source="cache")
+
+Histograms use fixed buckets (no per-observation allocation). When the
+registry is disabled ``timer`` returns a shared no-op context manager and
+``inc`` / ``observe`` return immediately, so instrumented code costs one
+attribute check.
+"""
+import bisect
+import threading
+import time
+
+from config import monitoring_config
+
+# Biên bucket (giây): 0.5 ms .. 60 s
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)   # ô cuối = +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bucket bound below which a fraction ``q`` of observations fall (an estimate)."""
+        if not self.count:
+            return 0.0
+        target, seen = q * self.count, 0
+        for bound, n in zip(self.buckets + (float("inf"),), self.counts):
+            seen += n
+            if seen >= target:
+                return bound
+        return float("inf")
+
+
+class _NullTimer:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer:
+    __slots__ = ("registry", "name", "labels", "start", "elapsed")
+
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+        self.elapsed = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        self.registry.observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+class Registry:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def inc(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def timer(self, name, **labels):
+        """Context manager observing the elapsed seconds into histogram ``name``."""
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name, labels)
+
+    def reset(self):
+        with self._lock:
+            self._counters.clear()
+            self._gauges.clear()
+            self._histograms.clear()
+
+    def snapshot(self):
+        """JSON-friendly view: counters, gauges and histogram count/sum/p50/p95/p99."""
+        def label_str(labels):
+            return ",".join(f"{k}={v}" for k, v in labels)
+
+        with self._lock:
+            return {
+                "counters": {f"{n}{{{label_str(l)}}}": v for (n, l), v in self._counters.items()},
+                "gauges": {f"{n}{{{label_str(l)}}}": v for (n, l), v in self._gauges.items()},
+                "histograms": {
+                    f"{n}{{{label_str(l)}}}": {
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                        "p50": h.quantile(0.5),
+                        "p95": h.quantile(0.95),
+                        "p99": h.quantile(0.99),
+                    }
+                    for (n, l), h in self._histograms.items()
+                },
+            }
+
+    def prometheus(self):
+        """Prometheus text exposition (version 0.0.4) of every metric."""
+        def fmt(labels, extra=()):
+            pairs = list(labels) + list(extra)
+            if not pairs:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+        lines = []
+        with self._lock:
+            for kind, metrics in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({n for n, _ in metrics}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    lines.extend(f"{name}{fmt(l)} {v}" for (n, l), v in metrics.items() if n == name)
+            for name in sorted({n for n, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (n, labels), h in self._histograms.items():
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(h.buckets + (float("inf"),), h.counts):
+                        cumulative += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"{name}_bucket{fmt(labels, [('le', le)])} {cumulative}")
+                    lines.append(f"{name}_sum{fmt(labels)} {h.sum}")
+                    lines.append(f"{name}_count{fmt(labels)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry(enabled=monitoring_config.metrics_enabled)
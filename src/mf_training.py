@@ -0,0 +1,161 @@
+# mf_training.py
+"""Training engine for MFRecommender: mini-batch SGD and ALS solvers with early stopping."""
+import numpy as np
+import scipy.sparse as sp
+
+from src.parallel import make_executor, resolve_workers
+from src.sparse_matrix import build_csr
+
+
+def holdout_split(n, fraction, rng):
+    """Random train / validation positions for ``n`` ratings (empty validation when fraction <= 0)."""
+    perm = rng.permutation(n)
+    n_val = int(n * fraction) if fraction > 0 else 0
+    if n_val == 0 or n_val >= n:
+        return perm, perm[:0]
+    return perm[n_val:], perm[:n_val]
+
+
+def rmse(P, Q, users, items, rates):
+    if len(rates) == 0:
+        return float("nan")
+    preds = np.einsum("ij,ij->i", P[users], Q[items])
+    return float(np.sqrt(np.mean((rates - preds) ** 2)))
+
+
+def _scatter_add(target, rows, updates):
+    """target[rows] += updates, summing the updates of rows that repeat inside the batch."""
+    uniq, inverse = np.unique(rows, return_inverse=True)
+    # scatter-sum qua một phép nhân sparse (nhanh hơn np.add.at cho mảng 2 chiều)
+    scatter = sp.csr_matrix(
+        (np.ones(len(rows), dtype=target.dtype), (inverse, np.arange(len(rows)))),
+        shape=(len(uniq), len(rows)),
+    )
+    target[uniq] += scatter @ updates
+
+
+def sgd_epoch(P, Q, users, items, rates, lr, reg, batch, rng):
+    """One epoch of mini-batch SGD, updating P and Q in place.
+
+    Gradients of a user / item that appears several times in the same batch
+    are accumulated instead of overwriting each other, so every rating counts.
+    """
+    idx = rng.permutation(len(rates))
+    for start in range(0, len(rates), batch):
+        batch_idx = idx[start:start + batch]
+
+        u = users[batch_idx]
+        i = items[batch_idx]
+        r = rates[batch_idx]
+
+        Pu = P[u]
+        Qi = Q[i]
+        err = r - np.einsum("ij,ij->i", Pu, Qi)
+
+        dP = (err[:, None] * Qi) - reg * Pu
+        dQ = (err[:, None] * Pu) - reg * Qi
+
+        _scatter_add(P, u, lr * dP)
+        _scatter_add(Q, i, lr * dQ)
+
+
+def ridge_solve(fixed, rates, reg):
+    """Least-squares factor row for ``rates`` against the rows ``fixed`` (one ALS row solve)."""
+    F = np.asarray(fixed, dtype=np.float64)
+    A = F.T @ F + reg * len(rates) * np.eye(F.shape[1])
+    return np.linalg.solve(A, F.T @ rates)
+
+
+def _solve_rows(target, fixed, matrix, reg, rows):
+    for row in rows:
+        start, end = matrix.indptr[row], matrix.indptr[row + 1]
+        if start == end:
+            continue
+        target[row] = ridge_solve(fixed[matrix.indices[start:end]], matrix.data[start:end], reg)
+
+
+def als_half_step(target, fixed, matrix, reg, executor, n_chunks):
+    """Solve every row of ``target`` by regularized least squares against the fixed factors.
+
+    ``matrix`` is the CSR rating matrix whose rows match ``target``; rows are
+    split into chunks that run on the executor (NumPy releases the GIL in the
+    solves).
+    """
+    chunks = np.array_split(np.arange(target.shape[0]), n_chunks)
+    futures = [executor.submit(_solve_rows, target, fixed, matrix, reg, c) for c in chunks if len(c)]
+    for f in futures:
+        f.result()
+
+
+def train_factors(P, Q, users, items, rates, cfg, rng=None, log=print):
+    """Train P and Q on encoded (users, items, rates) with the solver chosen in ``cfg``.
+
+    A ``cfg.validation_fraction`` slice of the ratings is held out; training
+    stops after ``cfg.early_stopping_patience`` epochs without improvement on it
+    and the best factors are returned. Returns ``(P, Q, history)`` where
+    ``history`` lists the validation RMSE per epoch.
+    """
+    rng = rng or np.random.default_rng()
+    train_idx, val_idx = holdout_split(len(rates), cfg.validation_fraction, rng)
+    tu, ti, tr = users[train_idx], items[train_idx], rates[train_idx]
+    vu, vi, vr = users[val_idx], items[val_idx], rates[val_idx]
+
+    solver = cfg.mf_solver
+    executor = None
+    if solver == "als":
+        n_workers = resolve_workers(cfg.n_jobs)
+        # threads: the solves share P/Q in place and NumPy releases the GIL
+        executor = make_executor(n_workers, backend="thread")
+        by_user = build_csr(tu, ti, tr, (P.shape[0], Q.shape[0]))
+        by_item = by_user.T.tocsr()
+    elif solver != "sgd":
+        raise ValueError(f"Unknown MF solver: {solver}")
+
+    history = []
+    best = (np.inf, None, None)
+    stale = 0
+    try:
+        for epoch in range(cfg.epochs):
+            if solver == "als":
+                als_half_step(P, Q, by_user, cfg.reg, executor, 4 * n_workers)
+                als_half_step(Q, P, by_item, cfg.reg, executor, 4 * n_workers)
+            else:
+                sgd_epoch(P, Q, tu, ti, tr, cfg.learning_rate, cfg.reg, cfg.mf_batch_size, rng)
+
+            val = rmse(P, Q, vu, vi, vr)
+            history.append(val)
+            log(f"[MF] Epoch {epoch+1}/{cfg.epochs} done (solver={solver}, val_rmse={val:.4f})")
+
+            if len(val_idx) == 0:
+                continue
+            if val < best[0]:
+                best = (val, P.copy(), Q.copy())
+                stale = 0
+            else:
+                stale += 1
+                if stale >= cfg.early_stopping_patience:
+                    log(f"[MF] Early stopping at epoch {epoch+1}, best val_rmse={best[0]:.4f}")
+                    break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    if best[1] is not None:
+        P, Q = best[1], best[2]
+    return P, Q, history
+
+
+def fold_in(P, Q, users, items, rates, new_users, new_items, cfg, rng=None):
+    """Update P and Q in place for a batch of new (encoded) ratings.
+
+    Rows without trained factors (``new_users`` / ``new_items``) are first
+    solved by ridge regression against the other side's factors, then
+    ``cfg.partial_fit_epochs`` SGD epochs run over the new ratings only.
+    """
+    rng = rng or np.random.default_rng()
+    by_user = build_csr(users, items, rates, (P.shape[0], Q.shape[0]))
+    _solve_rows(P, Q, by_user, cfg.reg, new_users)
+    _solve_rows(Q, P, by_user.T.tocsr(), cfg.reg, new_items)
+    for _ in range(cfg.partial_fit_epochs):
+        sgd_epoch(P, Q, users, items, rates, cfg.learning_rate, cfg.reg, cfg.mf_batch_size, rng)
+    return P, Q
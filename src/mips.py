@@ -0,0 +1,144 @@
+# mips.py
+"""Maximum inner-product search (MIPS) over MF item factors.
+
+Inner products are turned into cosine similarities with the usual
+augmentation: every item vector ``x`` becomes ``[x, sqrt(M² - |x|²)] / M``
+(``M`` = largest item norm) and a query ``q`` becomes ``[q / |q|, 0]``, so the
+item with the largest ``q·x`` is the one closest to the query on the unit
+sphere. Items are partitioned by spherical k-means (an IVF index); a query
+only scores the items of its ``n_probe`` closest lists, exactly.
+"""
+import numpy as np
+
+from src.artifacts import load_arrays, save_arrays
+from src.ranking import top_n_indices
+
+# Số điểm mẫu mỗi cụm khi huấn luyện k-means (gán toàn bộ item chỉ một lần ở cuối)
+_TRAIN_POINTS_PER_LIST = 64
+
+# Chấm điểm ít nhất chừng này item cho mỗi kết quả cần trả về (top-N lớn -> dò thêm cụm)
+_CANDIDATES_PER_RESULT = 8
+
+
+def augment_items(vectors):
+    """Unit-norm ``(n, d + 1)`` vectors whose cosine order equals the inner-product order."""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=1)
+    max_norm = float(norms.max()) if len(norms) else 1.0
+    max_norm = max_norm if max_norm > 0 else 1.0
+    extra = np.sqrt(np.maximum(max_norm ** 2 - norms ** 2, 0.0))
+    return np.hstack([vectors, extra[:, None]]) / np.float32(max_norm)
+
+
+def _assign(points, centroids, block_size=8192):
+    labels = np.empty(len(points), dtype=np.int32)
+    for start in range(0, len(points), block_size):
+        labels[start:start + block_size] = np.argmax(points[start:start + block_size] @ centroids.T, axis=1)
+    return labels
+
+
+def spherical_kmeans(points, n_clusters, iters=10, seed=0):
+    """Centroids (unit norm) of ``points`` clustered by cosine similarity."""
+    rng = np.random.default_rng(seed)
+    centroids = points[rng.choice(len(points), n_clusters, replace=False)].copy()
+    for _ in range(iters):
+        labels = _assign(points, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, points)
+        norms = np.linalg.norm(sums, axis=1)
+        # cụm rỗng -> giữ centroid cũ
+        filled = norms > 0
+        centroids[filled] = sums[filled] / norms[filled, None]
+    return centroids
+
+
+class InnerProductIndex:
+    """IVF index over item vectors; ``search`` returns item positions and exact inner products."""
+
+    def __init__(self, centroids, offsets, order, vectors, n_probe=16):
+        self.centroids = centroids   # (n_lists, d) query-side part of the augmented centroids
+        self.offsets = offsets       # list l holds order[offsets[l]:offsets[l + 1]]
+        self.order = order           # item positions grouped by list
+        self.vectors = vectors       # item vectors in ``order`` (contiguous per list)
+        self.n_probe = n_probe
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, n_probe=16, iters=10, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        n = len(vectors)
+        n_lists = int(n_lists or max(1, round(np.sqrt(n))))
+        n_lists = max(1, min(n_lists, n))
+
+        points = augment_items(vectors)
+        rng = np.random.default_rng(seed)
+        n_train = min(n, n_lists * _TRAIN_POINTS_PER_LIST)
+        sample = points[rng.choice(n, n_train, replace=False)] if n_train < n else points
+        centroids = spherical_kmeans(sample, n_lists, iters, seed)
+
+        labels = _assign(points, centroids)
+        order = np.argsort(labels, kind="stable").astype(np.int32)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(labels, minlength=n_lists))
+        return cls(
+            np.ascontiguousarray(centroids[:, :-1]),
+            offsets,
+            order,
+            np.ascontiguousarray(vectors[order]),
+            n_probe,
+        )
+
+    @property
+    def n_lists(self):
+        return len(self.offsets) - 1
+
+    def __len__(self):
+        return len(self.order)
+
+    def search(self, query, top_n, n_probe=None):
+        """Approximate top-``top_n`` items by ``query · item``: ``(positions, scores)``, best first.
+
+        Lists are probed closest first: at least ``n_probe`` of them, and more
+        for a large ``top_n`` until about ``8 * top_n`` items have been scored.
+        """
+        query = np.asarray(query, dtype=np.float32)
+        n_probe = n_probe or self.n_probe
+        list_order = np.argsort(-(self.centroids @ query), kind="stable")
+        sizes = np.diff(self.offsets)[list_order]
+        wanted = min(_CANDIDATES_PER_RESULT * top_n, len(self))
+        enough = np.searchsorted(np.cumsum(sizes), wanted)
+        probe = list_order[:max(n_probe, enough + 1)]
+
+        rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in probe])
+        scores = self.vectors[rows] @ query
+        best = top_n_indices(scores, top_n)
+        return self.order[rows[best]].astype(np.int64), scores[best]
+
+    def search_exact(self, query, top_n):
+        """Exhaustive scan with the same output as ``search``, for verification."""
+        scores = self.vectors @ np.asarray(query, dtype=np.float32)
+        best = top_n_indices(scores, top_n)
+        return self.order[best].astype(np.int64), scores[best]
+
+    def save(self, path):
+        save_arrays(
+            path,
+            {"centroids": self.centroids, "offsets": self.offsets, "order": self.order, "vectors": self.vectors},
+            {"n_probe": self.n_probe},
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays, meta = load_arrays(path, mmap_mode)
+        return cls(arrays["centroids"], arrays["offsets"], arrays["order"], arrays["vectors"], meta["n_probe"])
+
+
+def recall_at_n(index, queries, top_n=10, n_probe=None):
+    """Mean fraction of the exact top-``top_n`` items that ``index.search`` also returns."""
+    hits = 0
+    total = 0
+    for query in queries:
+        exact, _ = index.search_exact(query, top_n)
+        approx, _ = index.search(query, top_n, n_probe)
+        hits += len(np.intersect1d(exact, approx))
+        total += len(exact)
+    return hits / total if total else 1.0
@@ -0,0 +1,156 @@
+# neighbors.py
+import numpy as np
+import scipy.sparse as sp
+from dataclasses import dataclass
+from src.artifacts import load_arrays, save_arrays
+from src.parallel import map_blocks
+
+
+@dataclass
+class NeighborIndex:
+    """Top-k neighbors per row: ``ids`` are row positions (-1 = padding), ``weights`` cosine similarities."""
+
+    ids: np.ndarray       # int32, shape (n_rows, k)
+    weights: np.ndarray   # float32, shape (n_rows, k)
+
+    @property
+    def k(self):
+        return self.ids.shape[1]
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    def neighbors(self, row):
+        ids = self.ids[row]
+        valid = ids >= 0
+        return ids[valid], self.weights[row][valid]
+
+    def save(self, path):
+        save_arrays(path, {"ids": self.ids, "weights": self.weights})
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays, _ = load_arrays(path, mmap_mode)
+        return cls(arrays["ids"], arrays["weights"])
+
+
+def normalize_rows(matrix):
+    """Scale every row of a sparse matrix to unit L2 norm (cosine similarity = dot product of the results)."""
+    matrix = sp.csr_matrix(matrix, dtype=np.float32)
+    norm = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    return (sp.diags((1.0 / (norm + 1e-10)).astype(np.float32)) @ matrix).tocsr()
+
+
+def _top_k_block(sims, self_cols, k):
+    n_block, n_cols = sims.shape
+    rows = np.arange(n_block)
+    sims[rows, self_cols] = -np.inf
+
+    ids = np.full((n_block, k), -1, dtype=np.int32)
+    weights = np.zeros((n_block, k), dtype=np.float32)
+    kk = min(k, n_cols - 1)
+    if kk <= 0:
+        return ids, weights
+
+    top = np.argpartition(-sims, kk - 1, axis=1)[:, :kk]
+    top_sims = np.take_along_axis(sims, top, axis=1)
+    order = np.argsort(-top_sims, axis=1, kind="stable")
+    ids[:, :kk] = np.take_along_axis(top, order, axis=1)
+    weights[:, :kk] = np.take_along_axis(top_sims, order, axis=1)
+    return ids, weights
+
+
+def _neighbor_block(shared, start):
+    normed, normed_t, k, block_size = shared
+    end = min(start + block_size, normed.shape[0])
+    sims = (normed[start:end] @ normed_t).toarray()
+    return _top_k_block(sims, np.arange(start, end), k)
+
+
+def build_neighbor_index(matrix, k, block_size=1024, n_jobs=None, backend=None):
+    """Top-k cosine neighbors for every row of a sparse matrix.
+
+    Similarities are computed ``block_size`` rows at a time, so peak memory is
+    about ``workers × block_size × n_rows`` instead of the full
+    ``n_rows × n_rows`` matrix. Blocks are spread over the worker pool.
+    """
+    normed = normalize_rows(matrix)
+    normed_t = normed.T.tocsc()
+    n_rows = normed.shape[0]
+
+    ids = np.full((n_rows, k), -1, dtype=np.int32)
+    weights = np.zeros((n_rows, k), dtype=np.float32)
+    starts = range(0, n_rows, block_size)
+    blocks = map_blocks(_neighbor_block, starts, (normed, normed_t, k, block_size), n_jobs, backend)
+    for start, (block_ids, block_weights) in zip(starts, blocks):
+        end = start + len(block_ids)
+        ids[start:end], weights[start:end] = block_ids, block_weights
+    return NeighborIndex(ids, weights)
+
+
+def _update_block(shared, start):
+    normed, normed_t, touched, touched_t, is_touched, ids, weights, block_size = shared
+    end = min(start + block_size, normed.shape[0])
+    rows = np.arange(start, end)
+    k = ids.shape[1]
+
+    # hàng không đổi: giữ neighbor cũ chưa bị ảnh hưởng + độ tương đồng mới với các hàng đã đổi
+    old_ids = ids[start:end]
+    old_weights = np.where((old_ids < 0) | is_touched[np.maximum(old_ids, 0)], -np.inf, weights[start:end])
+    sims = (normed[start:end] @ touched_t).toarray()
+    sims[rows[:, None] == touched[None, :]] = -np.inf
+    cand_ids = np.hstack([old_ids, np.broadcast_to(touched, sims.shape)])
+    cand_weights = np.hstack([old_weights, sims])
+
+    top = np.argsort(-cand_weights, axis=1, kind="stable")[:, :k]
+    block_weights = np.take_along_axis(cand_weights, top, axis=1)
+    valid = np.isfinite(block_weights)
+    block_ids = np.where(valid, np.take_along_axis(cand_ids, top, axis=1), -1).astype(np.int32)
+    block_weights = np.where(valid, block_weights, 0).astype(np.float32)
+
+    # Hàng đã đổi tính lại toàn bộ. Hàng có neighbor bị tụt xuống dưới ngưỡng cũ (phần tử thứ k)
+    # cũng vậy: một hàng ngoài danh sách cũ có thể xứng đáng thay chỗ.
+    floor = np.where(old_ids >= 0, weights[start:end], np.inf).min(axis=1)
+    lowest = np.where(valid, block_weights, -np.inf).min(axis=1)
+    changed = rows[is_touched[rows] | (lowest < floor)]
+    if len(changed):
+        full = (normed[changed] @ normed_t).toarray()
+        block_ids[changed - start], block_weights[changed - start] = _top_k_block(full, changed, k)
+    return block_ids, block_weights
+
+
+def update_neighbor_index(index, matrix, touched, remap, block_size=1024, n_jobs=None, backend=None):
+    """Refresh a NeighborIndex after the rows ``touched`` of ``matrix`` changed.
+
+    ``remap`` maps old row positions to their positions in ``matrix`` (new rows
+    must be listed in ``touched``). Every other row merges its old list with
+    its similarities to the changed rows, at a cost of ``n_rows × len(touched)``
+    similarities instead of ``n_rows²``. Changed rows, and rows where a
+    changed neighbor fell below the old k-th similarity (so a row outside the
+    old list may now qualify), get a full top-k recomputation.
+    """
+    n_rows = matrix.shape[0]
+    k = index.k
+    touched = np.unique(np.asarray(touched, dtype=np.int64))
+    if len(touched) * 10 > n_rows:
+        # quá nhiều hàng thay đổi -> dựng lại toàn bộ rẻ hơn
+        return build_neighbor_index(matrix, k, block_size, n_jobs, backend)
+
+    ids = np.full((n_rows, k), -1, dtype=np.int32)
+    weights = np.zeros((n_rows, k), dtype=np.float32)
+    old_ids = np.asarray(index.ids)
+    ids[remap] = np.where(old_ids >= 0, remap[np.maximum(old_ids, 0)], -1)
+    weights[remap] = index.weights
+    is_touched = np.zeros(n_rows, dtype=bool)
+    is_touched[touched] = True
+
+    normed = normalize_rows(matrix)
+    normed_t = normed.T.tocsc()
+    touched_t = normed[touched].T.tocsc()
+    shared = (normed, normed_t, touched, touched_t, is_touched, ids, weights, block_size)
+    starts = range(0, n_rows, block_size)
+    blocks = map_blocks(_update_block, starts, shared, n_jobs, backend)
+    for start, (block_ids, block_weights) in zip(starts, blocks):
+        end = start + len(block_ids)
+        ids[start:end], weights[start:end] = block_ids, block_weights
+    return NeighborIndex(ids, weights)
@@ -0,0 +1,171 @@
+# offline_eval.py
+"""Offline evaluation: hold out part of every user's ratings, train, rank and score all test users.
+
+    python -m src.offline_eval [user_cf item_cf svd hybrid]
+
+Top-K lists come from the models' blocked scorers on the worker pool (train
+items excluded), and metrics are computed on the padded position arrays with
+the vectorized functions of src.evaluation. Results are printed and written
+to ``<processed_dir>/evaluation.json``.
+"""
+import json
+import sys
+import time
+from dataclasses import asdict
+from functools import partial
+
+import numpy as np
+from scipy import sparse
+
+from config import data_config, eval_config, model_config
+from src.collaborative_filtering import ItemBasedCF, UserBasedCF
+from src.data_preprocessing import preprocess_pipeline_streaming
+from src.evaluation import coverage_at_k, diversity_at_k, ranking_metrics
+from src.hybrid_model import HybridRecommender
+from src.matrix_factorization import MFRecommender
+from src.parallel import run_tasks
+from src.ranking import top_n_for_users
+from src.sparse_matrix import RatingMatrix
+
+ALGORITHMS = ("user_cf", "item_cf", "svd", "hybrid")
+
+
+def train_test_split(matrix, test_fraction=0.2, seed=42, min_train=1):
+    """``(train, test)`` RatingMatrix pair: ``test_fraction`` of each user's ratings held out at random.
+
+    Every user keeps at least ``min_train`` training ratings. Both halves share
+    the full user / item index, so positions line up between them.
+    """
+    by_user = matrix.by_user
+    counts = np.diff(by_user.indptr)
+    rows = np.repeat(np.arange(len(counts)), counts)
+    # xếp ngẫu nhiên trong từng hàng; rank = vị trí của rating trong thứ tự đó
+    order = np.lexsort((np.random.default_rng(seed).random(by_user.nnz), rows))
+    rank = np.empty(by_user.nnz, dtype=np.int64)
+    rank[order] = np.arange(by_user.nnz) - np.repeat(by_user.indptr[:-1], counts)
+    n_test = np.minimum(np.round(counts * test_fraction), np.maximum(counts - min_train, 0))
+    held_out = rank < n_test[rows]
+
+    def part(mask):
+        csr = sparse.csr_matrix(
+            (by_user.data[mask], (rows[mask], by_user.indices[mask])), shape=by_user.shape, dtype=np.float32
+        )
+        return RatingMatrix(csr, matrix.user_index, matrix.item_index)
+
+    return part(~held_out), part(held_out)
+
+
+def fit_models(train, algorithms=ALGORITHMS):
+    """``(models, fit_seconds)`` for ``algorithms``; independent models train concurrently."""
+    needed = set(algorithms)
+    builders = {}
+    if needed & {"user_cf", "hybrid"}:
+        builders["user_cf"] = UserBasedCF
+    if "item_cf" in needed:
+        builders["item_cf"] = ItemBasedCF
+    if needed & {"svd", "hybrid"}:
+        builders["svd"] = MFRecommender
+
+    def timed(cls):
+        t0 = time.perf_counter()
+        return cls().fit(train), time.perf_counter() - t0
+
+    fitted = run_tasks({name: partial(timed, cls) for name, cls in builders.items()}, n_jobs=model_config.n_jobs)
+    models = {name: model for name, (model, _) in fitted.items()}
+    seconds = {name: elapsed for name, (_, elapsed) in fitted.items()}
+    if "hybrid" in needed:
+        models["hybrid"] = HybridRecommender(user_cf=models["user_cf"], mf=models["svd"], w_cf=0.5, w_mf=0.5)
+        seconds["hybrid"] = seconds["user_cf"] + seconds["svd"]
+    return {name: models[name] for name in algorithms}, {name: seconds[name] for name in algorithms}
+
+
+def _hybrid_block(hybrid, user_ids, item_ids, positions):
+    return hybrid.score_users(user_ids[positions], item_ids)
+
+
+def _scorer(name, model, train):
+    """``fn(user positions) -> (block × train items)`` scores, picklable for the process backend."""
+    if name == "hybrid":
+        return partial(_hybrid_block, model, train.user_ids, train.item_ids)
+    return model.score_block
+
+
+def relevant_items(test, threshold=4.0):
+    """users × items CSR of the held-out ratings ``>= threshold`` (gain = the rating)."""
+    relevance = test.by_user.copy()
+    relevance.data[relevance.data < threshold] = 0
+    relevance.eliminate_zeros()
+    return relevance
+
+
+def evaluate(models, train, test, k=10, threshold=4.0, max_users=0, seed=42, item_vectors=None, log=print):
+    """Metrics per model name, over every user with a relevant held-out item (or a sample of ``max_users``)."""
+    relevance = relevant_items(test, threshold)
+    users = np.flatnonzero(np.diff(relevance.indptr) > 0)
+    if max_users and len(users) > max_users:
+        users = np.sort(np.random.default_rng(seed).choice(users, max_users, replace=False))
+    truth = relevance[users]
+    log(f"[Eval] {len(users)} test users, {truth.nnz} relevant held-out ratings, k={k}")
+
+    results = {}
+    for name, model in models.items():
+        t0 = time.perf_counter()
+        positions, _, _ = top_n_for_users(
+            _scorer(name, model, train),
+            users,
+            k,
+            exclude=train.by_user,
+            block_size=model_config.scoring_block_size,
+            n_jobs=model_config.n_jobs,
+            backend=model_config.parallel_backend,
+        )
+        elapsed = time.perf_counter() - t0
+        metrics = ranking_metrics(positions, truth, k)
+        metrics["coverage"] = coverage_at_k(positions, train.shape[1])
+        if item_vectors is not None:
+            metrics["diversity"] = diversity_at_k(positions, item_vectors)
+        metrics["rank_seconds"] = round(elapsed, 3)
+        metrics["users_per_s"] = round(len(users) / max(elapsed, 1e-9), 1)
+        results[name] = metrics
+        log(
+            f"[Eval] {name}: precision@{k}={metrics['precision']:.4f} recall@{k}={metrics['recall']:.4f} "
+            f"ndcg@{k}={metrics['ndcg']:.4f} coverage={metrics['coverage']:.3f} "
+            f"({metrics['users_per_s']:,.0f} users/s)"
+        )
+    return results
+
+
+def run(algorithms=ALGORITHMS, cfg=eval_config, out_path=None):
+    _, matrix = preprocess_pipeline_streaming()
+    train, test = train_test_split(matrix, cfg.test_fraction, cfg.seed, cfg.min_train_ratings)
+    print(f"[Eval] Split: train={train.nnz} ratings, test={test.nnz} ratings")
+
+    models, fit_seconds = fit_models(train, algorithms)
+    # khoảng cách giữa các phim gợi ý đo trên vector Q của MF (nếu có)
+    mf = models.get("svd") or getattr(models.get("hybrid"), "mf", None)
+    results = evaluate(
+        models,
+        train,
+        test,
+        k=cfg.k,
+        threshold=cfg.relevance_threshold,
+        max_users=cfg.max_users,
+        seed=cfg.seed,
+        item_vectors=mf.Q if mf is not None else None,
+    )
+    for name, seconds in fit_seconds.items():
+        results[name]["fit_seconds"] = round(seconds, 3)
+
+    out_path = out_path or data_config.processed_dir / "evaluation.json"
+    out_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(out_path, "w", encoding="utf-8") as f:
+        json.dump({"config": asdict(cfg), "results": results}, f, indent=2)
+    print(f"[Eval] Results written to {out_path}")
+    return results
+
+
+if __name__ == "__main__":
+    unknown = [a for a in sys.argv[1:] if a not in ALGORITHMS]
+    if unknown:
+        sys.exit(f"Unknown algorithm(s): {', '.join(unknown)}; choose from {', '.join(ALGORITHMS)}")
+    run(sys.argv[1:] or ALGORITHMS)
@@ -0,0 +1,85 @@
+# parallel.py
+"""Small worker-pool layer shared by model fitting, similarity blocks and batch scoring."""
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from config import model_config
+
+_SHARED = None
+_local = threading.local()
+
+
+def resolve_workers(n_jobs=None):
+    """``n_jobs`` from ModelConfig semantics: None/<=0 means every core."""
+    if n_jobs is None:
+        n_jobs = model_config.n_jobs
+    if n_jobs is None or n_jobs <= 0:
+        return os.cpu_count() or 1
+    return n_jobs
+
+
+def mark_worker():
+    """Mark the calling thread as a pool worker: map_blocks/run_tasks called from it run inline.
+
+    Used as a pool ``initializer`` so nested parallel calls do not start a
+    new pool per call on top of a pool that already keeps every core busy.
+    """
+    _local.worker = True
+
+
+def in_worker():
+    return getattr(_local, "worker", False)
+
+
+def _init_shared(shared):
+    global _SHARED
+    _SHARED = shared
+    mark_worker()
+
+
+def _call_shared(fn, item):
+    return fn(_SHARED, item)
+
+
+def make_executor(n_jobs=None, backend=None, shared=None):
+    backend = backend or model_config.parallel_backend
+    workers = resolve_workers(n_jobs)
+    if backend == "process":
+        return ProcessPoolExecutor(max_workers=workers, initializer=_init_shared, initargs=(shared,))
+    if backend == "thread":
+        return ThreadPoolExecutor(max_workers=workers, initializer=mark_worker)
+    raise ValueError(f"Unknown parallel backend: {backend}")
+
+
+def map_blocks(fn, items, shared=None, n_jobs=None, backend=None):
+    """Return ``[fn(shared, item) for item in items]``, computed on a worker pool.
+
+    ``fn`` must be a module-level function so the process backend can pickle
+    it; ``shared`` is sent once per worker process instead of once per item.
+    With a single worker, or when called from a pool worker (see
+    mark_worker), everything runs inline.
+    """
+    items = list(items)
+    backend = backend or model_config.parallel_backend
+    if resolve_workers(n_jobs) == 1 or len(items) <= 1 or in_worker():
+        return [fn(shared, item) for item in items]
+
+    with make_executor(n_jobs, backend, shared) as executor:
+        if backend == "process":
+            return list(executor.map(_call_shared, [fn] * len(items), items))
+        return list(executor.map(lambda item: fn(shared, item), items))
+
+
+def run_tasks(tasks, n_jobs=None):
+    """Run independent zero-argument callables concurrently on threads.
+
+    ``tasks`` maps a name to a callable; returns a dict name -> result.
+    Exceptions propagate to the caller like a sequential call would.
+    """
+    if resolve_workers(n_jobs) == 1 or len(tasks) <= 1 or in_worker():
+        return {name: task() for name, task in tasks.items()}
+
+    with ThreadPoolExecutor(max_workers=min(len(tasks), resolve_workers(n_jobs))) as executor:
+        futures = {name: executor.submit(task) for name, task in tasks.items()}
+        return {name: f.result() for name, f in futures.items()}
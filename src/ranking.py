@@ -0,0 +1,98 @@
+# ranking.py
+import numpy as np
+from src.parallel import map_blocks
+
+
+def top_n_indices(scores, top_n=None):
+    """Positions of the ``top_n`` highest scores, best first.
+
+    Uses ``argpartition`` so only the selected head is fully sorted; with
+    ``top_n=None`` the whole array is ranked. Ties go to the lower position,
+    also at the cut-off, so a longer list always starts with a shorter one.
+    """
+    scores = np.asarray(scores)
+    n = len(scores)
+    if top_n is None or top_n >= n:
+        return np.argsort(-scores, kind="stable")
+    if top_n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    head = np.argpartition(-scores, top_n - 1)[:top_n]
+    kth = scores[head].min()
+    if kth == kth:  # NaN (xếp cuối) thì không có tie để xử lý
+        # argpartition chọn tuỳ ý giữa các điểm bằng kth -> lấy các vị trí nhỏ nhất
+        above = np.flatnonzero(scores > kth)
+        tied = np.flatnonzero(scores == kth)[:top_n - len(above)]
+        head = np.concatenate([above, tied])
+    return head[np.lexsort((head, -scores[head]))]
+
+
+def combine_weighted(numer, denom, fallback):
+    """Weighted-average CF score ``numer / denom``, ``fallback`` where no neighbor contributed."""
+    numer = np.asarray(numer, dtype=np.float32)
+    denom = np.asarray(denom, dtype=np.float32)
+    out = np.broadcast_to(np.asarray(fallback, dtype=np.float32), numer.shape).copy()
+    np.divide(numer, denom, out=out, where=denom > 0)
+    return out
+
+
+def top_n_rows(scores, top_n):
+    """Row-wise top-N positions of a 2-D score block, best first."""
+    n_cols = scores.shape[1]
+    top_n = min(top_n, n_cols)
+    if top_n <= 0:
+        return np.zeros((scores.shape[0], 0), dtype=np.int64)
+    if top_n < n_cols:
+        head = np.argpartition(-scores, top_n - 1, axis=1)[:, :top_n]
+    else:
+        head = np.broadcast_to(np.arange(n_cols), scores.shape)
+    head_scores = np.take_along_axis(scores, head, axis=1)
+    order = np.lexsort((head, -head_scores), axis=1)
+    return np.take_along_axis(head, order, axis=1)
+
+
+def _rank_block(shared, block):
+    score_block, exclude, allowed, top_n = shared
+    scores = np.asarray(score_block(block), dtype=np.float32)
+    if allowed is not None:
+        scores[:, ~allowed] = -np.inf
+    if exclude is not None:
+        seen = exclude[block]
+        rows = np.repeat(np.arange(len(block)), np.diff(seen.indptr))
+        scores[rows, seen.indices] = -np.inf
+    counts = np.isfinite(scores).sum(axis=1).astype(np.int32)
+    positions = top_n_rows(scores, top_n)
+    top_scores = np.take_along_axis(scores, positions, axis=1)
+    if positions.shape[1] < top_n:
+        pad = top_n - positions.shape[1]
+        positions = np.pad(positions, ((0, 0), (0, pad)))
+        top_scores = np.pad(top_scores, ((0, 0), (0, pad)), constant_values=-np.inf)
+    positions = np.where(np.isfinite(top_scores), positions, -1).astype(np.int32)
+    return positions, np.where(positions >= 0, top_scores, np.nan).astype(np.float32), counts
+
+
+def top_n_for_users(score_block, user_positions, top_n, exclude=None, allowed=None,
+                    block_size=256, n_jobs=None, backend=None):
+    """Top-N item positions and scores for many users at once.
+
+    ``score_block(positions)`` returns a (users × items) score matrix; users
+    are scored ``block_size`` at a time on the worker pool. ``exclude`` is an
+    optional users × items CSR matrix of already-seen items and ``allowed`` an
+    optional boolean mask of rankable item columns. Rows shorter than
+    ``top_n`` are padded with position -1 / score NaN.
+
+    Returns ``(positions, scores, counts)`` where ``counts`` is the number of
+    rankable items of each user (the length of its full ranking).
+    """
+    user_positions = np.asarray(user_positions)
+    blocks = [user_positions[s:s + block_size] for s in range(0, len(user_positions), block_size)]
+    results = map_blocks(_rank_block, blocks, (score_block, exclude, allowed, top_n), n_jobs, backend)
+    if not results:
+        return (
+            np.zeros((0, top_n), dtype=np.int32),
+            np.zeros((0, top_n), dtype=np.float32),
+            np.zeros(0, dtype=np.int32),
+        )
+    positions = np.vstack([r[0] for r in results])
+    scores = np.vstack([r[1] for r in results])
+    counts = np.concatenate([r[2] for r in results])
+    return positions, scores, counts
@@ -0,0 +1,247 @@
+# sparse_matrix.py
+import numpy as np
+import scipy.sparse as sp
+from src.artifacts import load_arrays, save_arrays
+
+
+class IdIndex:
+    """Bidirectional map between raw ids (userId/movieId) and contiguous positions 0..n-1."""
+
+    def __init__(self, ids):
+        # ids phải được sắp xếp tăng dần và không trùng lặp
+        self.ids = np.asarray(ids)
+
+    @classmethod
+    def from_values(cls, values):
+        return cls(np.unique(np.asarray(values)))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, raw_id):
+        return self.index(raw_id) >= 0
+
+    def encode(self, raw_ids, missing=-1):
+        """Vectorized raw id -> position; unknown ids map to ``missing``."""
+        raw_ids = np.asarray(raw_ids)
+        if len(self.ids) == 0:
+            return np.full(raw_ids.shape, missing, dtype=np.int64)
+        pos = np.searchsorted(self.ids, raw_ids)
+        pos = np.minimum(pos, len(self.ids) - 1)
+        found = self.ids[pos] == raw_ids
+        return np.where(found, pos, missing).astype(np.int64)
+
+    def index(self, raw_id):
+        return int(self.encode(np.asarray([raw_id]))[0])
+
+    def decode(self, positions):
+        return self.ids[np.asarray(positions)]
+
+    def union(self, raw_ids):
+        """Index over these ids plus ``raw_ids``, and where each old position moved to."""
+        merged = IdIndex(np.union1d(self.ids, np.asarray(raw_ids, dtype=self.ids.dtype)))
+        return merged, np.searchsorted(merged.ids, self.ids)
+
+
+class RatingMatrix:
+    """Sparse user×item rating storage.
+
+    ``by_user`` is a CSR matrix (users × items) and ``by_item`` a CSR matrix
+    (items × users) over the same ratings, so row access is cheap in both
+    directions. Missing ratings are implicit zeros, the same convention the
+    dense ``pivot_table(...).fillna(0)`` used before.
+    """
+
+    def __init__(self, by_user, user_index, item_index):
+        self.by_user = by_user.tocsr()
+        self.by_user.sort_indices()
+        self.user_index = user_index
+        self.item_index = item_index
+        self._by_item = None
+
+    @classmethod
+    def from_arrays(cls, users, items, values):
+        users = np.asarray(users)
+        items = np.asarray(items)
+        values = np.asarray(values, dtype=np.float32)
+
+        user_index = IdIndex.from_values(users)
+        item_index = IdIndex.from_values(items)
+        rows = user_index.encode(users).astype(np.int32)
+        cols = item_index.encode(items).astype(np.int32)
+        shape = (len(user_index), len(item_index))
+
+        return cls(build_csr(rows, cols, values, shape), user_index, item_index)
+
+    @classmethod
+    def from_frame(cls, ratings):
+        return cls.from_arrays(
+            ratings["userId"].to_numpy(),
+            ratings["movieId"].to_numpy(),
+            ratings["rating"].to_numpy(),
+        )
+
+    @property
+    def by_item(self):
+        if self._by_item is None:
+            self._by_item = self.by_user.T.tocsr()
+            self._by_item.sort_indices()
+        return self._by_item
+
+    @property
+    def shape(self):
+        return self.by_user.shape
+
+    @property
+    def nnz(self):
+        return self.by_user.nnz
+
+    @property
+    def user_ids(self):
+        return self.user_index.ids
+
+    @property
+    def item_ids(self):
+        return self.item_index.ids
+
+    def coo(self):
+        """(user positions, item positions, ratings) of every stored rating."""
+        rows = np.repeat(np.arange(self.shape[0], dtype=np.int32), np.diff(self.by_user.indptr))
+        return rows, self.by_user.indices, self.by_user.data
+
+    def user_row(self, u):
+        """Item positions and ratings of user position ``u``."""
+        start, end = self.by_user.indptr[u], self.by_user.indptr[u + 1]
+        return self.by_user.indices[start:end], self.by_user.data[start:end]
+
+    def item_row(self, i):
+        """User positions and ratings of item position ``i``."""
+        start, end = self.by_item.indptr[i], self.by_item.indptr[i + 1]
+        return self.by_item.indices[start:end], self.by_item.data[start:end]
+
+    def values_at(self, users, items):
+        """Ratings at (user position, item position) pairs, 0 where unrated."""
+        users = np.asarray(users).ravel()
+        items = np.asarray(items).ravel()
+        if users.size == 0:
+            return np.zeros(0, dtype=np.float32)
+        return np.asarray(self.by_user[users, items]).ravel().astype(np.float32)
+
+    def merged(self, delta):
+        """New matrix holding these ratings plus ``delta`` (another RatingMatrix); self is untouched.
+
+        A rating in ``delta`` replaces the stored rating of the same (user, movie).
+        Returns ``(matrix, user_remap, item_remap)`` where the remaps give the new
+        position of every old user / item position.
+        """
+        user_index, user_remap = self.user_index.union(delta.user_ids)
+        item_index, item_remap = self.item_index.union(delta.item_ids)
+        shape = (len(user_index), len(item_index))
+
+        rows, cols, values = self.coo()
+        rows, cols = user_remap[rows], item_remap[cols]
+        d_rows, d_cols, d_values = delta.coo()
+        d_rows = user_index.encode(delta.user_ids)[d_rows]
+        d_cols = item_index.encode(delta.item_ids)[d_cols]
+
+        # điểm mới ghi đè điểm cũ của cùng cặp (user, phim)
+        keep = ~np.isin(rows.astype(np.int64) * shape[1] + cols, d_rows.astype(np.int64) * shape[1] + d_cols)
+        by_user = build_csr(
+            np.concatenate([rows[keep], d_rows]),
+            np.concatenate([cols[keep], d_cols]),
+            np.concatenate([values[keep], d_values]),
+            shape,
+        )
+        return RatingMatrix(by_user, user_index, item_index), user_remap, item_remap
+
+    def user_mean(self, u):
+        _, values = self.user_row(u)
+        return float(values.mean()) if len(values) else 0.0
+
+    def save(self, path):
+        save_arrays(
+            path,
+            {
+                "indptr": self.by_user.indptr,
+                "indices": self.by_user.indices,
+                "data": self.by_user.data,
+                "user_ids": self.user_ids,
+                "item_ids": self.item_ids,
+            },
+            {"shape": list(self.shape)},
+        )
+
+    @classmethod
+    def load(cls, path, mmap_mode=None):
+        arrays, meta = load_arrays(path, mmap_mode)
+        by_user = sp.csr_matrix(
+            (arrays["data"], arrays["indices"], arrays["indptr"]),
+            shape=tuple(meta["shape"]),
+            copy=False,
+        )
+        return cls(by_user, IdIndex(arrays["user_ids"]), IdIndex(arrays["item_ids"]))
+
+    def user_means(self):
+        """Mean rating of every user position (0 for users without ratings)."""
+        counts = np.diff(self.by_user.indptr)
+        sums = np.asarray(self.by_user.sum(axis=1), dtype=np.float32).ravel()
+        means = np.zeros(len(counts), dtype=np.float32)
+        np.divide(sums, counts, out=means, where=counts > 0)
+        return means
+
+    def item_popularity(self, damping=10.0):
+        """Damped mean rating of every item position: ``(sum + d·μ) / (count + d)``.
+
+        Items with few ratings are pulled towards the global mean ``μ``, so the
+        ranking favours movies that are both well rated and often rated.
+        """
+        counts = np.bincount(self.by_user.indices, minlength=self.shape[1]).astype(np.float32)
+        sums = np.bincount(self.by_user.indices, weights=self.by_user.data, minlength=self.shape[1])
+        mu = float(self.by_user.data.mean()) if self.nnz else 0.0
+        out = np.full(self.shape[1], mu, dtype=np.float64)
+        np.divide(sums + damping * mu, counts + damping, out=out, where=counts + damping > 0)
+        return out.astype(np.float32)
+
+
+def build_csr(rows, cols, values, shape):
+    """float32 CSR matrix from coordinates; duplicate coordinates are averaged."""
+    values = np.asarray(values, dtype=np.float32)
+    matrix = sp.csr_matrix((values, (rows, cols)), shape=shape, dtype=np.float32)
+    if matrix.nnz < len(values):
+        # pivot_table lấy trung bình khi một user chấm một phim nhiều lần
+        counts = sp.csr_matrix(
+            (np.ones(len(values), dtype=np.float32), (rows, cols)), shape=shape
+        )
+        matrix.sort_indices()
+        counts.sort_indices()
+        matrix.data /= counts.data
+    matrix.sort_indices()
+    return matrix
+
+
+def csr_arrays(prefix, matrix):
+    """Flatten a CSR matrix into named arrays for save_arrays."""
+    return {
+        f"{prefix}_data": matrix.data,
+        f"{prefix}_indices": matrix.indices,
+        f"{prefix}_indptr": matrix.indptr,
+        f"{prefix}_shape": np.asarray(matrix.shape, dtype=np.int64),
+    }
+
+
+def csr_from_arrays(prefix, arrays):
+    """Inverse of csr_arrays; memory-mapped inputs stay memory-mapped (no copy)."""
+    return sp.csr_matrix(
+        (arrays[f"{prefix}_data"], arrays[f"{prefix}_indices"], arrays[f"{prefix}_indptr"]),
+        shape=tuple(int(n) for n in arrays[f"{prefix}_shape"]),
+        copy=False,
+    )
+
+
+def binary_pattern(matrix):
+    """Same sparsity structure as ``matrix`` with every stored value set to 1 (index arrays are shared)."""
+    return sp.csr_matrix(
+        (np.ones_like(matrix.data), matrix.indices, matrix.indptr),
+        shape=matrix.shape,
+        copy=False,
+    )
@@ -1,154 +1,310 @@
 # ===== FIX IMPORT PATH =====
-import sys, os, math, csv
+import sys, os, math, logging, time
+from contextlib import contextmanager
 from pathlib import Path
 ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(ROOT_DIR)
 sys.path.append(os.path.join(ROOT_DIR, "src"))
 # ============================
 
-from flask import Flask, jsonify, render_template, request
-from config import web_config
+import numpy as np
+from flask import Flask, Response, g, jsonify, render_template, request
+from config import data_config, monitoring_config, web_config
+from cache import RecommendationCache, cache_key
+import request_profiler
+from serving import Overloaded, ScoringExecutor, configure_logging, serve
+from src.metrics import registry
 from utils import (
-    RecommenderBundle,
-    candidate_items,
-    get_recommender_bundle,
+    ALGORITHMS,
+    bundle_holder,
+    get_precomputed,
+    ranker,
+    rating_updater,
+    require_model,
 )
 
 app = Flask(__name__)
 
-# Cache directory for precomputed recommendations
+# Result cache: LRU in memory, SQLite tier under CACHE_DIR (survives restarts)
 CACHE_DIR = Path(ROOT_DIR) / "data" / "processed" / "recommendations"
 
+result_cache = RecommendationCache(
+    max_bytes=web_config.result_cache_mb * 2**20,
+    disk_path=CACHE_DIR / "results.sqlite" if web_config.result_cache_disk else None,
+    disk_max_entries=web_config.result_cache_disk_max_entries,
+)
 
-def _serialize(recs):
-    output = []
-    for r in recs:
-        meta = r.get("metadata")
-        title = r.get("title", None)
-        if meta is None and title:
-            meta = {"title": title}
-        output.append({
-            "movieId": r.get("movieId", None),
-            "title": title,
-            "score": r.get("score", 0),
-            "metadata": meta,
-        })
-    return output
-
-
-def _cache_file(algorithm: str, user_id: int) -> Path:
-    return CACHE_DIR / f"{algorithm}_user{user_id}.csv"
-
-
-def _save_cache(path: Path, recs: list[dict]):
-    path.parent.mkdir(parents=True, exist_ok=True)
-    with open(path, "w", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=["movieId", "title", "score"])
-        writer.writeheader()
-        for r in recs:
-            title = r.get("title") or (r.get("metadata") or {}).get("title")
-            writer.writerow({
-                "movieId": r.get("movieId"),
-                "title": title,
-                "score": r.get("score", 0),
-            })
-
-
-def _load_cache(path: Path) -> list[dict]:
-    recs = []
-    with open(path, newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            try:
-                score = float(row.get("score", 0))
-            except Exception:
-                score = 0
-            movie_id = row.get("movieId")
-            recs.append({
-                "movieId": int(movie_id) if movie_id not in (None, "") else None,
-                "title": row.get("title") or None,
-                "score": score,
-                "metadata": {"title": row.get("title")} if row.get("title") else None,
-            })
-    return recs
+# Xếp hạng (tốn CPU) chạy trong pool có giới hạn; request đọc cache không phải chờ
+scoring = ScoringExecutor(
+    workers=web_config.scoring_workers,
+    max_pending=web_config.scoring_max_pending,
+    timeout=web_config.scoring_timeout_s,
+)
 
+DATASET_MISSING = "Dataset not found. Please place movies.csv and ratings.csv into data/raw."
+
+PROFILE_DIR = data_config.processed_dir / "profiles"
+
+request_log = logging.getLogger("web_app.requests")
+
+
+@app.before_request
+def _warm_up():
+    # khi chạy dưới WSGI server khác (không qua __main__), request đầu tiên kích hoạt việc nạp model
+    bundle_holder.start()
+    if registry.enabled:
+        g.started = time.perf_counter()
+        g.stages = {}
+
+
+@app.after_request
+def _record_request(response):
+    if not registry.enabled or "started" not in g:
+        return response
+    elapsed = time.perf_counter() - g.started
+    endpoint = request.url_rule.rule if request.url_rule is not None else "unmatched"
+    registry.observe("http_request_seconds", elapsed, endpoint=endpoint)
+    registry.inc("http_requests_total", endpoint=endpoint, status=response.status_code)
+    stages_ms = {name: round(1e3 * seconds, 3) for name, seconds in g.stages.items()}
+    request_log.info(
+        "%s %s %d %.1fms %s", request.method, request.path, response.status_code, 1e3 * elapsed, stages_ms,
+        extra={"fields": {
+            "method": request.method,
+            "path": request.path,
+            "status": response.status_code,
+            "duration_ms": round(1e3 * elapsed, 3),
+            "stages_ms": stages_ms,
+        }},
+    )
+    return response
+
+
+def _score(fn, bundle, selected, *args, **kwargs):
+    """Run ``fn(bundle, selected, ...)`` on the bounded scoring executor.
+
+    Raises ModelLoading (503) while the selected model is still being built,
+    so no scoring worker waits on a load. A profiled request ranks inline
+    instead, since cProfile only sees the thread it was started in.
+    """
+    require_model(bundle, selected)
+    if g.get("profiling"):
+        return fn(bundle, selected, *args, **kwargs)
+    return scoring.run(fn, bundle, selected, *args, **kwargs)
+
+
+def _profiled(label, fn):
+    """``(fn(), profile)``; ``profile`` describes the cProfile run when the request asked for one, else None."""
+    if not request_profiler.requested(request, monitoring_config):
+        return fn(), None
+    with request_profiler.exclusive_profile() as session:
+        if session is None:
+            return fn(), {"skipped": "another request is being profiled"}
+        g.profiling = True
+        try:
+            result = session.runcall(fn)
+        finally:
+            g.profiling = False
+            report = session.save(PROFILE_DIR, label, monitoring_config.profile_top)
+            request_log.info("Profile of %s written to %s", label, report["file"])
+    return result, report
+
+
+@contextmanager
+def _stage(name):
+    """Time one step of the current request into ``request_stage_seconds{stage=name}`` and the request log."""
+    if not registry.enabled:
+        yield
+        return
+    with registry.timer("request_stage_seconds", stage=name) as timer:
+        yield
+    stages = g.get("stages")
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + timer.elapsed
+
+
+def _current_bundle():
+    """``(bundle, error_response)``: never waits for the models to load."""
+    bundle = bundle_holder.get(wait=False)
+    if bundle is not None:
+        return bundle, None
+    status = bundle_holder.status()
+    if status["state"] == "loading":
+        return None, (jsonify({**status, "error": "Models are loading, please retry shortly."}), 503, {"Retry-After": "5"})
+    if status["state"] == "failed":
+        return None, (jsonify({**status, "error": f"Models failed to load: {status['error']}"}), 503)
+    return None, (jsonify({"error": DATASET_MISSING}), 400)
+
+
+def _serialize(movie_ids, scores, metadata) -> list[dict]:
+    with _stage("metadata"):
+        titles = metadata.lookup(movie_ids)
+    return [
+        {
+            "movieId": int(mid),
+            "title": title,
+            "score": float(score),
+            "metadata": {"title": title} if title else None,
+        }
+        for mid, score, title in zip(movie_ids, scores, titles)
+    ]
 
-def _build_recommendations(bundle, selected: str, user: int, page: int) -> list[dict]:
-    cache_path = _cache_file(selected, user)
 
-    if cache_path.exists():
-        return _load_cache(cache_path)
+def _rank(bundle, selected: str, user: int, top_n, candidates=None, profile=None, exact=False):
+    """``(movie_ids, scores, total)`` from the selected model, best ``top_n`` only.
 
+    ``exact`` turns off MF's approximate (IVF) retrieval.
+    """
     if selected == "user_cf":
         if bundle.user_cf is None:
             raise RuntimeError("User-Based CF is not available.")
-        recs = bundle.user_cf.recommend(user, bundle.movies, top_n=None)
-        recommendations_all = _serialize([
-            {
-                "movieId": r.movieId,
-                "score": r.score,
-                "title": r.metadata["title"] if r.metadata else None,
-            } for r in recs
-        ])
+        return bundle.user_cf.rank(user, top_n, candidates, profile)
 
-    elif selected == "item_cf":
+    if selected == "item_cf":
         if bundle.item_cf is None:
             raise RuntimeError("Item-Based CF is not available.")
-        recs = bundle.item_cf.recommend(user, bundle.movies, top_n=None)
-        recommendations_all = _serialize([
-            {
-                "movieId": r.movieId,
-                "score": r.score,
-                "title": r.metadata["title"] if r.metadata else None,
-            } for r in recs
-        ])
-
-    elif selected == "svd":
-        cand = candidate_items(bundle, limit=None)
-        recs = bundle.svd.recommend(
-            userId=user,
-            candidate_items=cand,
-            top_n=None,
-            movies=bundle.movies,
-        )
-        recommendations_all = _serialize(recs)
+        return bundle.item_cf.rank(user, top_n, candidates, profile)
 
-    else:
-        recs = bundle.hybrid.recommend(
-            user,
-            bundle.movies,
-            top_n=None,
-        )
-        recommendations_all = _serialize(recs)
+    if selected == "svd":
+        # không truyền cả catalog: để MF dùng chỉ mục IVF thay vì chấm điểm từng phim
+        return bundle.svd.rank(user, top_n, candidates, profile, exact=exact)
+
+    return bundle.hybrid.rank(user, bundle.metadata, top_n, candidates, profile)
 
-    _save_cache(cache_path, recommendations_all)
-    return recommendations_all
 
+def _parse_profile(raw: str):
+    """``"movieId:rating,movieId:rating"`` -> ``(movie_ids, ratings)``, None when empty."""
+    if not raw:
+        return None
+    try:
+        pairs = [item.split(":") for item in raw.split(",") if item.strip()]
+        movie_ids = np.array([int(m) for m, _ in pairs], dtype=np.int64)
+        ratings = np.array([float(r) for _, r in pairs], dtype=np.float32)
+    except ValueError:
+        raise ValueError("ratings must look like movieId:rating,movieId:rating")
+    return (movie_ids, ratings) if len(movie_ids) else None
+
+
+def _is_known_user(bundle, user: int) -> bool:
+    pos = np.searchsorted(bundle.user_ids, user)
+    return pos < len(bundle.user_ids) and bundle.user_ids[pos] == user
+
+
+def _build_recommendations(bundle, selected: str, user: int, page: int, per_page: int = 10):
+    """Cached top-K list long enough to serve ``page``.
+
+    Lists precomputed by the batch job are served as they are. Otherwise the
+    first request ranks ``web_config.candidate_pool`` movies; paging past the
+    end of the cached list re-ranks exactly with a pool at least twice as
+    large and keeps the pages already served in front.
+    """
+    needed = page * per_page
+    head = None
+    key = cache_key(bundle.cache_version(user), selected, user)
+    with _stage("cache"):
+        cached = result_cache.get(key)
+    if cached is not None:
+        movie_ids, _, total = cached
+        if len(movie_ids) >= min(needed, total):
+            registry.inc("recommendations_total", source="cache")
+            return cached
+        head = cached
+        top_n = max(needed, 2 * len(movie_ids))
+    else:
+        with _stage("precomputed"):
+            # bảng tính sẵn không biết rating mới của user -> chỉ dùng cho user không đổi
+            precomputed = None if bundle.has_new_ratings(user) else get_precomputed(bundle, selected)
+            found = precomputed.get(user) if precomputed is not None else None
+        if found is not None and len(found[0]) >= min(needed, found[2]):
+            registry.inc("recommendations_total", source="precomputed")
+            return found
+        head = found
+        top_n = max(needed, web_config.candidate_pool)
+
+    registry.inc("recommendations_total", source="computed")
+    with _stage("score"):
+        return _score(_rank_cached, bundle, selected, user, top_n, head=head)
+
+
+def _store(bundle, selected: str, user: int, ranked):
+    """Put one ranked list into the result cache; returns the packed value."""
+    movie_ids, scores, total = ranked
+    with registry.timer("request_stage_seconds", stage="cache_store"):
+        key = cache_key(bundle.cache_version(user), selected, user)
+        return result_cache.put(key, movie_ids, scores, total, version=bundle.version)
+
+
+def _extend(head, ranked):
+    """``head`` followed by the movies of ``ranked`` it does not already contain."""
+    head_ids, head_scores, _ = head
+    movie_ids, scores, total = ranked
+    rest = ~np.isin(movie_ids, head_ids)
+    return np.concatenate([head_ids, movie_ids[rest]]), np.concatenate([head_scores, scores[rest]]), total
+
+
+def _rank_cached(bundle, selected: str, user: int, top_n, head=None):
+    """_rank() that caches its result on the scoring thread.
+
+    A ranking that outlives its request (503 on timeout) still lands in the
+    cache, so the client's retry is a hit instead of another slow ranking.
+    With ``head`` (a shorter list already served) the ranking is exact and
+    spliced behind it, so later pages never repeat or skip a movie.
+    """
+    if head is None:
+        return _store(bundle, selected, user, _rank(bundle, selected, user, top_n))
+    ranked = _rank(bundle, selected, user, top_n, exact=True)
+    return _store(bundle, selected, user, _extend(head, ranked))
+
+
+def _filter_search(bundle, selected: str, user: int, query: str, top_n: int, profile=None):
+    """Rank only the movies whose title/id matches ``query`` (looked up in the title index)."""
+    with _stage("search"):
+        matches = bundle.metadata.search(query)
+    registry.inc("recommendations_total", source="search")
+    with _stage("score"):
+        return _score(_rank, bundle, selected, user, top_n, candidates=matches, profile=profile)
+
+
+def _page(bundle, selected: str, user: int, page: int, per_page: int, search_query: str, profile=None):
+    """Return ``(rows, page, total_pages, total_results)`` for one page of recommendations.
+
+    ``profile`` (ratings sent with the request) is folded in for users the
+    models do not know; such results depend on the request, so they bypass
+    the result cache.
+    """
+    # kiểm tra trước khi dựng cache key: giá trị lạ không được tạo entry riêng
+    if selected not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm: {selected}")
+    if profile is not None and _is_known_user(bundle, user):
+        profile = None
+    if search_query:
+        movie_ids, scores, total = _filter_search(bundle, selected, user, search_query, page * per_page, profile)
+    elif profile is not None:
+        registry.inc("recommendations_total", source="profile")
+        with _stage("score"):
+            movie_ids, scores, total = _score(_rank, bundle, selected, user, page * per_page, profile=profile)
+    else:
+        movie_ids, scores, total = _build_recommendations(bundle, selected, user, page, per_page)
 
-def _filter_search(recs: list[dict], query: str) -> list[dict]:
-    if not query:
-        return recs
-    q = query.lower()
-    filtered = []
-    for r in recs:
-        title = (r.get("metadata") or {}).get("title") or r.get("title") or ""
-        mid = str(r.get("movieId", ""))
-        if q in title.lower() or q in mid.lower():
-            filtered.append(r)
-    return filtered
+    total_pages = max(1, math.ceil(total / per_page)) if total else 1
+    page = min(page, total_pages)
+    start = (page - 1) * per_page
+    end = start + per_page
+    rows = _serialize(movie_ids[start:end], scores[start:end], bundle.metadata)
+    return rows, page, total_pages, total
 
 
 @app.route("/", methods=["GET", "POST"])
 def index():
-    bundle = get_recommender_bundle()
+    bundle = bundle_holder.get(wait=False)
     ready = bundle is not None
+    loading = bundle_holder.state == "loading"
     recommendations = []
-    recommendations_all = []
     error = None
 
     selected = request.form.get("algorithm", "hybrid")
     user_id = request.form.get("user_id", web_config.default_user_id)
     search_query = request.form.get("search", "").strip()
+    ratings_param = request.form.get("ratings", "").strip()
     try:
         page = max(1, int(request.form.get("page", 1)))
     except ValueError:
@@ -158,31 +314,28 @@ def index():
     total_results = 0
 
     if request.method == "POST":
-        if not ready:
-            error = "Dataset not found. Please place movies.csv and ratings.csv into data/raw."
+        if loading:
+            error = "Models are loading, please retry shortly."
+        elif not ready:
+            error = DATASET_MISSING
         else:
             try:
                 user = int(user_id)
-                recommendations_all = _build_recommendations(bundle, selected, user, page)
-                recommendations_all = _filter_search(recommendations_all, search_query)
+                recommendations, page, total_pages, total_results = _page(
+                    bundle, selected, user, page, per_page, search_query, _parse_profile(ratings_param)
+                )
 
             except Exception as exc:
                 error = str(exc)
 
-    total_results = len(recommendations_all)
-    if total_results:
-        total_pages = max(1, math.ceil(total_results / per_page))
-        page = min(page, total_pages)
-        start = (page - 1) * per_page
-        end = start + per_page
-        recommendations = recommendations_all[start:end]
-    else:
+    if not total_results:
         page = 1
         total_pages = 1
 
     return render_template(
         "index.html",
         ready=ready,
+        loading=loading,
         recommendations=recommendations,
         error=error,
         selected_algorithm=selected,
@@ -194,22 +347,34 @@ def index():
         search_query=search_query,
     )
 
+@app.route("/healthz")
+def healthz():
+    """Liveness: the process answers requests (models may still be loading)."""
+    return jsonify({"status": "ok"})
+
+
+@app.route("/readyz")
+def readyz():
+    """Readiness: 200 once the bundle is served and ``preload_models`` are built, 503 before that."""
+    status = bundle_holder.status()
+    status["scoring"] = scoring.snapshot()
+    return jsonify(status), 200 if status["state"] == "ready" else 503
+
+
 @app.route("/api/users")
 def api_users():
-    bundle = get_recommender_bundle()
+    bundle, error = _current_bundle()
     if bundle is None:
-        return jsonify([])
+        return jsonify([]) if bundle_holder.state == "unavailable" else error
 
-    user_ids = bundle.ratings["userId"].unique().tolist()
-    user_ids = sorted(user_ids)
-    return jsonify(user_ids)
+    return jsonify(bundle.user_ids.tolist())
 
 
 @app.route("/api/recommendations")
 def api_recommendations():
-    bundle = get_recommender_bundle()
+    bundle, error = _current_bundle()
     if bundle is None:
-        return jsonify({"error": "Dataset not found. Please place movies.csv and ratings.csv into data/raw."}), 400
+        return error
 
     selected = request.args.get("algorithm", "hybrid")
     try:
@@ -222,23 +387,23 @@ def api_recommendations():
     except Exception:
         page = 1
     search_query = request.args.get("search", "").strip()
+    try:
+        profile = _parse_profile(request.args.get("ratings", "").strip())
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
 
     per_page = 10
     try:
-        recs_all = _build_recommendations(bundle, selected, user, page)
+        (data, page, total_pages, total_results), report = _profiled(
+            f"recommendations-{selected}-{user}",
+            lambda: _page(bundle, selected, user, page, per_page, search_query, profile),
+        )
+    except Overloaded as exc:
+        return jsonify({"error": str(exc)}), 503, {"Retry-After": str(exc.retry_after)}
     except Exception as exc:
         return jsonify({"error": str(exc)}), 400
 
-    recs_all = _filter_search(recs_all, search_query)
-
-    total_results = len(recs_all)
-    total_pages = max(1, math.ceil(total_results / per_page)) if total_results else 1
-    page = min(page, total_pages)
-    start = (page - 1) * per_page
-    end = start + per_page
-    data = recs_all[start:end]
-
-    return jsonify({
+    body = {
         "algorithm": selected,
         "user_id": user,
         "page": page,
@@ -247,8 +412,204 @@ def api_recommendations():
         "total_results": total_results,
         "data": data,
         "search": search_query,
-    })
+    }
+    if report is not None:
+        body["profile"] = report
+    with _stage("serialize"):
+        return jsonify(body)
+
+
+def _rank_batch(bundle, selected: str, user_ids, top_n):
+    """``{user: (movie_ids, scores, total)}`` for ``user_ids``, scored block by block in one pass."""
+    rank_many = ranker(bundle, selected, top_n)
+    if rank_many is None:
+        raise RuntimeError(f"{selected} is not available.")
+    users, movie_ids, scores, totals = rank_many(user_ids)
+    out = {}
+    for user, ids, row, total in zip(users, movie_ids, scores, totals):
+        keep = ids >= 0
+        out[int(user)] = (ids[keep], row[keep], int(total))
+    # user model không biết: xếp theo độ phổ biến, giống nhau cho mọi user -> tính một lần
+    unknown = np.setdiff1d(user_ids, users)
+    if len(unknown):
+        shared = _rank(bundle, selected, int(unknown[0]), top_n)
+        out.update({int(user): shared for user in unknown})
+    return out
+
+
+def _rank_batch_cached(bundle, selected: str, user_ids, top_n):
+    """_rank_batch() caching every list on the scoring thread (see _rank_cached)."""
+    ranked = _rank_batch(bundle, selected, user_ids, top_n)
+    return {user: _store(bundle, selected, user, lists) for user, lists in ranked.items()}
+
+
+def _batch_recommendations(bundle, selected: str, user_ids, top_n: int):
+    """Top lists for every user: cached/precomputed ones reused, the rest ranked together.
+
+    Returns ``({user: (movie_ids, scores, total)}, reused)``. Newly ranked
+    lists are ``candidate_pool`` long and go into the result cache, so later
+    single-user page requests hit them too.
+    """
+    found = {}
+    with _stage("cache"):
+        precomputed = get_precomputed(bundle, selected)
+        for user in user_ids:
+            hit = result_cache.get(cache_key(bundle.cache_version(user), selected, user))
+            if hit is None and precomputed is not None and not bundle.has_new_ratings(user):
+                hit = precomputed.get(user)
+            if hit is not None and len(hit[0]) >= min(top_n, hit[2]):
+                found[user] = hit
+    reused = len(found)
+    registry.inc("recommendations_total", reused, source="batch_reused")
+
+    missing = np.array([user for user in user_ids if user not in found], dtype=np.int64)
+    if len(missing):
+        pool = max(top_n, web_config.candidate_pool)
+        registry.inc("recommendations_total", len(missing), source="batch_computed")
+        with _stage("score"):
+            found.update(_score(_rank_batch_cached, bundle, selected, missing, pool))
+    return found, reused
+
+
+def _parse_batch(payload):
+    """``(algorithm, user_ids, top_n)`` from a batch request; raises ValueError with a client-facing message."""
+    if not isinstance(payload, dict):
+        raise ValueError("Expected {\"user_ids\": [...], \"algorithm\": ..., \"top_n\": ...}")
+    selected = payload.get("algorithm", "hybrid")
+    if selected not in ALGORITHMS:
+        raise ValueError(f"Unknown algorithm: {selected}")
+    try:
+        # bỏ user trùng, giữ thứ tự gửi lên
+        user_ids = list(dict.fromkeys(int(u) for u in payload["user_ids"]))
+        top_n = int(payload.get("top_n", web_config.recommendations_limit))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("user_ids must be a list of integers and top_n an integer")
+    if not user_ids:
+        raise ValueError("user_ids is empty")
+    if len(user_ids) > web_config.batch_max_users:
+        raise ValueError(f"At most {web_config.batch_max_users} user_ids per request")
+    if not 1 <= top_n <= web_config.candidate_pool:
+        raise ValueError(f"top_n must be between 1 and {web_config.candidate_pool}")
+    return selected, user_ids, top_n
+
+
+@app.route("/api/recommendations/batch", methods=["POST"])
+def api_recommendations_batch():
+    """Top-N for many users in one call: ``{"user_ids": [...], "algorithm": "hybrid", "top_n": 10}``."""
+    bundle, error = _current_bundle()
+    if bundle is None:
+        return error
+    try:
+        selected, user_ids, top_n = _parse_batch(request.get_json(silent=True))
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    try:
+        (results, reused), report = _profiled(
+            f"batch-{selected}-{len(user_ids)}users",
+            lambda: _batch_recommendations(bundle, selected, user_ids, top_n),
+        )
+    except Overloaded as exc:
+        return jsonify({"error": str(exc)}), 503, {"Retry-After": str(exc.retry_after)}
+    except Exception as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    body = {
+        "algorithm": selected,
+        "top_n": top_n,
+        "cached": reused,
+        "computed": len(user_ids) - reused,
+        "results": [
+            {
+                "user_id": user,
+                "total_results": results[user][2],
+                "data": _serialize(results[user][0][:top_n], results[user][1][:top_n], bundle.metadata),
+            }
+            for user in user_ids
+        ],
+    }
+    if report is not None:
+        body["profile"] = report
+    return jsonify(body)
+
+
+def _parse_ratings(payload, metadata):
+    """DataFrame of submitted ratings; raises ValueError with a client-facing message."""
+    rows = payload.get("ratings", [payload]) if isinstance(payload, dict) else payload
+    if not isinstance(rows, list) or not rows:
+        raise ValueError("Expected a rating object or {\"ratings\": [...]}")
+    import pandas as pd   # chỉ cần khi nhận rating, không làm chậm lúc khởi động
+
+    try:
+        ratings = pd.DataFrame({
+            "userId": [int(r["userId"]) for r in rows],
+            "movieId": [int(r["movieId"]) for r in rows],
+            "rating": [float(r["rating"]) for r in rows],
+        })
+    except (KeyError, TypeError, ValueError):
+        raise ValueError("Each rating needs integer userId, movieId and numeric rating")
+    # id được lưu dạng int32: ngoài khoảng này astype sẽ tràn âm thầm
+    id_max = np.iinfo(np.int32).max
+    for column in ("userId", "movieId"):
+        if not ratings[column].between(1, id_max).all():
+            raise ValueError(f"{column} must be between 1 and {id_max}")
+    unknown = [m for m, t in zip(ratings["movieId"], metadata.lookup(ratings["movieId"])) if t is None]
+    if unknown:
+        raise ValueError(f"Unknown movieId: {unknown[:10]}")
+    if not ratings["rating"].between(0.5, 5.0).all():
+        raise ValueError("Ratings must be between 0.5 and 5")
+    return ratings.astype({"userId": "int32", "movieId": "int32", "rating": "float32"})
+
+
+@app.route("/api/ratings", methods=["POST"])
+def api_ratings():
+    """Queue new ratings; models are updated in the background and swapped in atomically."""
+    bundle, error = _current_bundle()
+    if bundle is None:
+        return error
+    try:
+        ratings = _parse_ratings(request.get_json(silent=True), bundle.metadata)
+    except ValueError as exc:
+        return jsonify({"error": str(exc)}), 400
+
+    pending = rating_updater.submit(ratings)
+    return jsonify({"accepted": len(ratings), "pending": pending, "version": bundle.version}), 202
+
+
+@app.route("/api/cache/stats")
+def api_cache_stats():
+    return jsonify(result_cache.snapshot())
+
+
+def _refresh_gauges():
+    """Copy point-in-time state (cache, scoring pool, model bundle) into gauges before a scrape."""
+    for name, value in result_cache.snapshot().items():
+        registry.set_gauge(f"result_cache_{name}", value)
+    for name, value in scoring.snapshot().items():
+        registry.set_gauge(f"scoring_{name}", value)
+    status = bundle_holder.status()
+    registry.set_gauge("bundle_ready", int(status["state"] == "ready"))
+    if status["load_seconds"] is not None:
+        registry.set_gauge("bundle_startup_seconds", status["load_seconds"])
+    registry.set_gauge("rating_updates_pending", rating_updater.pending)
+
+
+@app.route("/metrics")
+def metrics():
+    """Prometheus text format; ``?format=json`` for counters, gauges and p50/p95/p99 per histogram."""
+    if not registry.enabled:
+        return jsonify({"error": "Metrics are disabled (monitoring_config.metrics_enabled)."}), 404
+    _refresh_gauges()
+    if request.args.get("format") == "json":
+        return jsonify(registry.snapshot())
+    return Response(registry.prometheus(), mimetype="text/plain; version=0.0.4")
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
+    configure_logging(monitoring_config.log_format, monitoring_config.log_level)
+    # nạp model ở background ngay khi khởi động; /readyz báo khi sẵn sàng
+    bundle_holder.start()
+    if "--serve" in sys.argv[1:]:
+        serve(app, web_config.host, web_config.port, web_config.server_threads)
+    else:
+        app.run(debug=True, use_reloader=False)
@@ -0,0 +1,49 @@
+# batch_job.py
+# Tính sẵn top-N gợi ý cho mọi user của model hiện tại (chạy hằng đêm):
+#   python web_app/batch_job.py [algorithm ...]
+# Kết quả nằm cạnh artifacts của model, app.py đọc trực tiếp (memory-map).
+
+# ===== FIX IMPORT PATH =====
+import sys, os
+ROOT_DIR = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(ROOT_DIR)
+sys.path.append(os.path.join(ROOT_DIR, "src"))
+# ============================
+
+from config import web_config
+from src.batch import write_recommendations
+from utils import ALGORITHMS, get_recommender_bundle, precomputed_dir, ranker
+
+
+def run(algorithms=ALGORITHMS, top_n=None, chunk_users=None):
+    bundle = get_recommender_bundle()
+    if bundle is None:
+        print("[Batch] Dataset not found. Please place movies.csv and ratings.csv into data/raw.")
+        return 1
+    root = precomputed_dir(bundle)
+    if root is None:
+        print("[Batch] Precomputed results need model artifacts (web_config.use_artifacts).")
+        return 1
+
+    top_n = top_n or web_config.batch_top_n
+    chunk_users = chunk_users or web_config.batch_chunk_users
+    for algorithm in algorithms:
+        # chỉ model của thuật toán được chọn mới được nạp
+        rank_many = ranker(bundle, algorithm, top_n) if algorithm in ALGORITHMS else None
+        if rank_many is None:
+            print(f"[Batch] {algorithm} is not available, skipped")
+            continue
+        rate = write_recommendations(
+            root / algorithm,
+            rank_many,
+            bundle.user_ids,
+            top_n,
+            chunk_users=chunk_users,
+            meta={"algorithm": algorithm, "version": bundle.version},
+        )
+        print(f"[Batch] {algorithm} done: {rate:,.0f} users/s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(run(sys.argv[1:] or ALGORITHMS))
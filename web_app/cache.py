@@ -0,0 +1,208 @@
+# cache.py
+"""Recommendation result cache: in-process LRU bounded by bytes + optional SQLite disk tier.
+
+Values are bounded top-K lists ``(movie_ids int32, scores float32, total)``,
+where ``total`` is how many movies could have been ranked, so a short list can
+be extended when a client pages past its end. Titles are joined from the
+metadata store when a result is served. Keys embed the model
+version, so results from older models are never served after a retrain, and
+a per-user token once new ratings of that user were applied; the disk tier
+is purged only when the model version itself changes.
+"""
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass
+
+import numpy as np
+
+# Ước lượng chi phí Python cho mỗi entry (key, tuple, 2 ndarray header)
+_ENTRY_OVERHEAD = 256
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    disk_hits: int = 0
+    disk_writes: int = 0
+
+    def as_dict(self):
+        data = asdict(self)
+        lookups = self.hits + self.misses
+        data["hit_rate"] = self.hits / lookups if lookups else 0.0
+        return data
+
+
+def cache_key(version, algorithm, user_id):
+    return f"{version}:{algorithm}:{user_id}"
+
+
+def _pack(movie_ids, scores, total):
+    return (
+        np.ascontiguousarray(movie_ids, dtype=np.int32),
+        np.ascontiguousarray(scores, dtype=np.float32),
+        int(total),
+    )
+
+
+class LRUCache:
+    """Thread-safe LRU whose capacity is a byte budget rather than an entry count."""
+
+    def __init__(self, max_bytes, stats=None):
+        self.max_bytes = max_bytes
+        self.stats = stats or CacheStats()
+        self._data = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(value):
+        return value[0].nbytes + value[1].nbytes + _ENTRY_OVERHEAD
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            self._data.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value):
+        size = self._size(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, (_, evicted) = self._data.popitem(last=False)
+                self._bytes -= evicted
+                self.stats.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    @property
+    def nbytes(self):
+        return self._bytes
+
+    def __len__(self):
+        return len(self._data)
+
+
+class DiskCache:
+    """Single-file SQLite tier holding the arrays as raw blobs, indexed by key."""
+
+    def __init__(self, path, max_entries=100_000):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._db = None
+        self._writes = 0
+
+    @property
+    def _conn(self):
+        # mở kết nối khi dùng lần đầu (không tạo file lúc import, an toàn khi fork worker)
+        if self._db is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS ranked ("
+                " key TEXT PRIMARY KEY, version TEXT, movie_ids BLOB, scores BLOB, total INTEGER, created REAL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute("SELECT movie_ids, scores, total FROM ranked WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return np.frombuffer(row[0], dtype=np.int32), np.frombuffer(row[1], dtype=np.float32), row[2]
+
+    def put(self, key, value, version=""):
+        movie_ids, scores, total = value
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ranked VALUES (?, ?, ?, ?, ?, ?)",
+                (key, version, movie_ids.tobytes(), scores.tobytes(), total, time.time()),
+            )
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                self._trim()
+            self._conn.commit()
+
+    def _trim(self):
+        self._conn.execute(
+            "DELETE FROM ranked WHERE key NOT IN (SELECT key FROM ranked ORDER BY created DESC LIMIT ?)",
+            (self.max_entries,),
+        )
+
+    def purge_other_versions(self, version):
+        """Drop entries computed by any other model version."""
+        with self._lock:
+            self._conn.execute("DELETE FROM ranked WHERE version != ?", (version,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM ranked")
+            self._conn.commit()
+
+
+class RecommendationCache:
+    """Memory LRU in front of an optional disk tier, with shared hit/miss/eviction counters."""
+
+    def __init__(self, max_bytes, disk_path=None, disk_max_entries=100_000):
+        self.stats = CacheStats()
+        self.memory = LRUCache(max_bytes, self.stats)
+        self.disk = DiskCache(disk_path, disk_max_entries) if disk_path is not None else None
+        self._disk_version = None
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        from_disk = False
+        if value is None and self.disk is not None:
+            value = self.disk.get(key)
+            if value is not None:
+                from_disk = True
+                self.memory.put(key, value)
+        with self._lock:
+            if value is None:
+                self.stats.misses += 1
+            else:
+                self.stats.hits += 1
+                self.stats.disk_hits += from_disk
+        return value
+
+    def put(self, key, movie_ids, scores, total, version=""):
+        value = _pack(movie_ids, scores, total)
+        self.memory.put(key, value)
+        if self.disk is not None:
+            if version != self._disk_version:
+                self.disk.purge_other_versions(version)
+                self._disk_version = version
+            self.disk.put(key, value, version)
+            with self._lock:
+                self.stats.disk_writes += 1
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def snapshot(self):
+        data = self.stats.as_dict()
+        data.update({"entries": len(self.memory), "bytes": self.memory.nbytes, "max_bytes": self.memory.max_bytes})
+        return data
@@ -0,0 +1,86 @@
+# request_profiler.py
+"""On-demand cProfile of a single request.
+
+Opt-in twice: ``MonitoringConfig.profiling_enabled`` must be on and the
+request must carry ``X-Profile: <token>`` or ``?profile=<token>`` (any
+non-empty value when no ``profile_token`` is configured). Each profile is
+written under ``<processed_dir>/profiles`` as a ``.prof`` file (pstats /
+snakeviz) plus a text summary sorted by cumulative time. cProfile only
+sees the calling thread: work fanned out to the worker pool (batch
+ranking with n_jobs > 1) shows up as time spent waiting for it.
+"""
+import cProfile
+import io
+import pstats
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+# một profiler tại một thời điểm trong process; request khác chạy bình thường
+_lock = threading.Lock()
+
+
+def requested(request, cfg):
+    """True when profiling is enabled and this request asks for it with a valid token."""
+    if not cfg.profiling_enabled:
+        return False
+    value = request.headers.get("X-Profile") or request.args.get("profile")
+    if not value:
+        return False
+    return not cfg.profile_token or value == cfg.profile_token
+
+
+class RequestProfile:
+    def __init__(self):
+        self.profiler = cProfile.Profile()
+        self.seconds = 0.0
+
+    def runcall(self, fn, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return self.profiler.runcall(fn, *args, **kwargs)
+        finally:
+            self.seconds = time.perf_counter() - start
+
+    def save(self, out_dir, label, top=25):
+        """Write ``.prof`` + ``.txt`` files; returns their paths and the ``top`` functions by cumulative time."""
+        out_dir.mkdir(parents=True, exist_ok=True)
+        slug = re.sub(r"[^A-Za-z0-9_.-]+", "_", label).strip("_")
+        stem = out_dir / f"{time.strftime('%Y%m%d-%H%M%S')}-{int(time.time_ns() % 10**6):06d}-{slug}"
+        prof_path, text_path = stem.with_suffix(".prof"), stem.with_suffix(".txt")
+        self.profiler.dump_stats(str(prof_path))
+
+        text = io.StringIO()
+        stats = pstats.Stats(self.profiler, stream=text).sort_stats("cumulative")
+        stats.print_stats(top)
+        text_path.write_text(f"{label}: {self.seconds * 1e3:.1f} ms\n{text.getvalue()}", encoding="utf-8")
+
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:top]
+        return {
+            "label": label,
+            "seconds": round(self.seconds, 6),
+            "file": str(prof_path),
+            "summary": str(text_path),
+            "top": [
+                {
+                    "function": f"{filename}:{line}({name})",
+                    "calls": calls,
+                    "tottime": round(tottime, 6),
+                    "cumtime": round(cumtime, 6),
+                }
+                for (filename, line, name), (_, calls, tottime, cumtime, _) in rows
+            ],
+        }
+
+
+@contextmanager
+def exclusive_profile():
+    """A RequestProfile, or None while another request is being profiled."""
+    if not _lock.acquire(blocking=False):
+        yield None
+        return
+    try:
+        yield RequestProfile()
+    finally:
+        _lock.release()
@@ -0,0 +1,127 @@
+# serving.py
+"""Production serving helpers: a bounded executor for CPU-bound scoring and a threaded WSGI server.
+
+Request threads stay free for cheap work (cache hits, ``/api/users``,
+health checks); ranking runs on at most ``workers`` threads, and once
+``max_pending`` rankings are queued or running new ones are rejected with
+Overloaded so the app can answer 503 instead of piling requests up.
+Scoring threads are marked as pool workers, so the block-parallel model
+code they call runs inline instead of starting a pool per request. A
+ranking that times out keeps running to completion; callers make the task
+store its own result (see app._rank_cached) so a retry can reuse it.
+configure_logging switches the process to plain-text or JSON-line logs.
+"""
+import json
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+
+from src.parallel import mark_worker
+
+logger = logging.getLogger(__name__)
+
+
+class Overloaded(RuntimeError):
+    """The scoring executor is full (or a ranking did not finish in time)."""
+
+    retry_after = 1   # giây, gửi trong header Retry-After
+
+
+class ScoringExecutor:
+    def __init__(self, workers=4, max_pending=32, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self._slots = threading.BoundedSemaphore(max_pending)
+        # các thread chấm điểm đã chạy song song với nhau -> map_blocks bên trong chạy tuần tự
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="scoring", initializer=mark_worker)
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    def run(self, fn, *args, **kwargs):
+        """``fn(*args, **kwargs)`` on a scoring thread; raises Overloaded instead of waiting for a slot."""
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.rejected += 1
+            raise Overloaded("Server is busy, please retry shortly.")
+        with self._lock:
+            self.in_flight += 1
+        try:
+            future = self._pool.submit(fn, *args, **kwargs)
+        except Exception:
+            self._release(None)
+            raise
+        # slot chỉ được trả khi việc chấm điểm thật sự xong (kể cả khi request đã timeout)
+        future.add_done_callback(self._release)
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeout:
+            with self._lock:
+                self.timeouts += 1
+            raise Overloaded("Scoring took too long, please retry shortly.")
+
+    def _release(self, _future):
+        with self._lock:
+            self.in_flight -= 1
+            self.completed += _future is not None
+        self._slots.release()
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "in_flight": self.in_flight,
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "timeouts": self.timeouts,
+            }
+
+
+def serve(app, host="127.0.0.1", port=5000, threads=16):
+    """Run ``app`` on a multi-threaded server: waitress when installed, else werkzeug's threaded server."""
+    try:
+        from waitress import serve as waitress_serve
+    except ImportError:
+        waitress_serve = None
+
+    if waitress_serve is not None:
+        logger.info("Serving on http://%s:%d with waitress (%d threads)", host, port, threads)
+        waitress_serve(app, host=host, port=port, threads=threads)
+        return
+
+    from werkzeug.serving import run_simple
+
+    logger.info("waitress not installed, serving on http://%s:%d with werkzeug (thread per request)", host, port)
+    run_simple(host, port, app, threaded=True, use_reloader=False, use_debugger=False)
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line; ``extra={"fields": {...}}`` entries are merged in."""
+
+    def format(self, record):
+        data = {
+            "ts": self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        data.update(getattr(record, "fields", None) or {})
+        if record.exc_info:
+            data["exc"] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+def configure_logging(fmt="text", level="INFO"):
+    """Root logging to stderr as plain text or structured JSON lines."""
+    handler = logging.StreamHandler()
+    if fmt == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.handlers[:] = [handler]
+    root.setLevel(level)
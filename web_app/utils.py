@@ -6,71 +6,539 @@ sys.path.append(ROOT_DIR)
 sys.path.append(os.path.join(ROOT_DIR, "src"))
 # ============================
 
+import copy
+import hashlib
 import logging
-from dataclasses import dataclass
-from functools import lru_cache
-import pandas as pd
+import threading
+import time
+from functools import partial
+import numpy as np
 
-from config import web_config
-from src.collaborative_filtering import ItemBasedCF, UserBasedCF
-from src.data_preprocessing import preprocess_pipeline
-from src.hybrid_model import HybridRecommender
-from src.matrix_factorization import MFRecommender
+from config import data_config, model_config, web_config
+from src.artifacts import ArtifactStore, fingerprint, load_arrays, save_arrays
+from src.metrics import registry
+from src.parallel import run_tasks
+from serving import Overloaded
+
+# pandas, scipy và các module model chỉ được import khi cần (nạp / huấn luyện model),
+# để process trả lời health check và cache hit gần như ngay sau khi khởi động
 
 logger = logging.getLogger(__name__)
 
+ALGORITHMS = ("user_cf", "item_cf", "svd", "hybrid")
+
+# model có artifact riêng -> thư mục con trong artifacts (hybrid ghép từ user_cf + svd)
+MODEL_DIRS = {"user_cf": "user_cf", "item_cf": "item_cf", "svd": "mf"}
+
+
+def _model_class(name):
+    if name == "svd":
+        from src.matrix_factorization import MFRecommender
+        return MFRecommender
+    from src.collaborative_filtering import ItemBasedCF, UserBasedCF
+    return UserBasedCF if name == "user_cf" else ItemBasedCF
+
 
-@dataclass
 class RecommenderBundle:
-    movies: pd.DataFrame
-    ratings: pd.DataFrame
-    user_cf: object     # không ép kiểu cứng để tránh lỗi import vòng lặp
-    item_cf: object
-    svd: MFRecommender
-    hybrid: HybridRecommender
+    """Metadata and user ids of one model version; each model is built on first use.
 
+    ``loaders`` maps a model name (``MODEL_DIRS``) to a zero-argument function
+    loading or training it; its result is kept, so a model is built at most
+    once per bundle, and a request that needs only MF never pays for CF.
+    A loader may return None (CF that failed to train). The hybrid is put
+    together from ``user_cf`` and ``svd`` the first time it is asked for.
 
-def _prepare():
-    try:
-        movies, ratings = preprocess_pipeline()
-    except Exception as exc:
-        logger.warning("Dataset missing: %s", exc)
-        return None
+    ``version`` is the artifact key and survives rating updates; users whose
+    ratings were applied since get their own token in ``user_versions``, so
+    only their cached / precomputed results stop being served.
+    """
 
-    user_cf = None
-    item_cf = None
-    try:
-        user_cf = UserBasedCF().fit(ratings)
-        item_cf = ItemBasedCF().fit(ratings)
-    except Exception as exc:
-        logger.warning("CF initialization failed: %s", exc)
+    def __init__(self, metadata, user_ids, loaders, version="", models=None, user_versions=None, updates=0):
+        self.metadata = metadata
+        self.user_ids = user_ids
+        self.version = version
+        self.user_versions = dict(user_versions or {})
+        self.updates = updates
+        self._loaders = dict(loaders)
+        self._loaders["hybrid"] = lambda: _make_hybrid(self.user_cf, self.svd)
+        self._models = dict(models or {})
+        self._locks = {name: threading.Lock() for name in ALGORITHMS}
+        self._background = set()
+        self._background_lock = threading.Lock()
+
+    def model(self, name):
+        if name in self._models:
+            return self._models[name]
+        with self._locks[name]:
+            # request khác có thể đã nạp xong trong lúc chờ khoá
+            if name not in self._models:
+                with registry.timer("model_load_seconds", model=name):
+                    self._models[name] = self._loaders[name]()
+                logger.info("Model %s ready (%s)", name, self.version or "untracked")
+        return self._models[name]
+
+    def loaded(self, name):
+        return name in self._models
+
+    def has_new_ratings(self, user):
+        return int(user) in self.user_versions
+
+    def cache_version(self, user):
+        """Version of ``user``'s results: the model version, plus a token once new ratings of the user are in."""
+        token = self.user_versions.get(int(user))
+        return self.version if token is None else f"{self.version}+{token}"
+
+    @property
+    def loaded_models(self):
+        return [name for name in ALGORITHMS if name in self._models]
+
+    def _try_model(self, name):
+        try:
+            return self.model(name)
+        except Exception:
+            logger.exception("Loading model %s failed", name)
+            return None
+
+    def preload(self, names):
+        """Build ``names`` now, independent models concurrently; a failure is logged and retried on next use."""
+        # hybrid = user_cf + svd: dựng song song các model độc lập trước
+        parts = dict.fromkeys(part for name in names for part in (("user_cf", "svd") if name == "hybrid" else (name,)))
+        run_tasks({name: partial(self._try_model, name) for name in parts}, n_jobs=model_config.n_jobs)
+        if "hybrid" in names:
+            self._try_model("hybrid")
+
+    def load_in_background(self, name):
+        """Start building ``name`` on its own thread (no-op while it is built or already being built)."""
+        with self._background_lock:
+            if name in self._models or name in self._background:
+                return
+            self._background.add(name)
+
+        def run():
+            try:
+                self._try_model(name)
+            finally:
+                with self._background_lock:
+                    self._background.discard(name)
+
+        threading.Thread(target=run, name=f"load-{name}", daemon=True).start()
+
+    user_cf = property(lambda self: self.model("user_cf"))
+    item_cf = property(lambda self: self.model("item_cf"))
+    svd = property(lambda self: self.model("svd"))
+    hybrid = property(lambda self: self.model("hybrid"))
+
+
+class ModelLoading(Overloaded):
+    """The model a request needs is still being loaded or trained in the background."""
+
+    retry_after = 5
+
+
+def require_model(bundle: RecommenderBundle, algorithm: str):
+    """Raise ModelLoading, and start building the model, unless ``algorithm``'s model is ready.
 
-    mf = MFRecommender().fit(ratings)
+    Keeps loading / training out of the bounded scoring pool: a slow first
+    build must not hold scoring workers that requests for ready models need.
+    """
+    name = algorithm if algorithm in ALGORITHMS else "hybrid"
+    if not bundle.loaded(name):
+        bundle.load_in_background(name)
+        raise ModelLoading(f"Model {name} is loading, please retry shortly.")
 
-    hybrid = HybridRecommender(
+
+def _make_hybrid(user_cf, mf):
+    from src.hybrid_model import HybridRecommender
+
+    return HybridRecommender(
         user_cf=user_cf,
         mf=mf,
         w_cf=0.5 if user_cf is not None else 0.0,
         w_mf=0.5 if user_cf is not None else 1.0,
     )
 
+
+def _once(fn):
+    """``fn`` (no arguments) run at most once, even from concurrent threads; later calls return its result."""
+    lock, result = threading.Lock(), []
+
+    def wrapper():
+        with lock:
+            if not result:
+                result.append(fn())
+        return result[0]
+
+    return wrapper
+
+
+def _load_ratings():
+    from src.data_preprocessing import preprocess_pipeline_streaming
+
+    with registry.timer("model_fit_seconds", model="data", phase="load"):
+        return preprocess_pipeline_streaming()
+
+
+def _fit(name, ratings, store=None, key=None):
+    """Train model ``name`` on the ``ratings()`` matrix; saved into artifact version ``key`` when given."""
+    try:
+        model = _model_class(name)().fit(ratings())
+    except Exception as exc:
+        if name == "svd":
+            raise
+        logger.warning("CF initialization failed: %s", exc)
+        return None
+    if store is not None:
+        try:
+            store.save_part(key, MODEL_DIRS[name], model.save)
+        except OSError as exc:
+            logger.warning("Could not save %s artifacts: %s", name, exc)
+    return model
+
+
+def _train_bundle(store=None, key=""):
+    """Bundle over freshly preprocessed data; models train on first use (and are saved when ``store``)."""
+    from src.metadata import MovieMetadata
+
+    try:
+        movies, ratings = _load_ratings()
+    except Exception as exc:
+        logger.warning("Dataset missing: %s", exc)
+        return None
+
+    metadata = MovieMetadata.from_movies(movies)
+    if store is not None:
+        try:
+            save_bundle(metadata, ratings.user_ids, store, key)
+        except OSError as exc:
+            logger.warning("Could not save model artifacts: %s", exc)
+            store = None
+    matrix = lambda: ratings
     return RecommenderBundle(
-        movies=movies,
-        ratings=ratings,
-        user_cf=user_cf,
-        item_cf=item_cf,
-        svd=mf,
-        hybrid=hybrid,
+        metadata=metadata,
+        user_ids=ratings.user_ids,
+        loaders={name: partial(_fit, name, matrix, store, key) for name in MODEL_DIRS},
+        version=key,
     )
 
 
-@lru_cache(maxsize=1)
+def save_bundle(metadata, user_ids, store: ArtifactStore, key: str):
+    """New artifact version with the shared parts; models are added by ``_fit`` as they get trained."""
+    def write(path):
+        metadata.save(path / "metadata")
+        save_arrays(path / "bundle", {"user_ids": user_ids})
+
+    return store.save(key, write)
+
+
+def load_bundle(store: ArtifactStore, key: str, mmap_mode=None):
+    from src.metadata import MovieMetadata
+
+    path = store.path(key)
+    arrays, _ = load_arrays(path / "bundle", mmap_mode)
+    # model chưa có artifact (chưa từng được dùng) -> huấn luyện khi cần, dữ liệu chỉ nạp một lần
+    ratings = _once(lambda: _load_ratings()[1])
+    loaders = {}
+    for name, subdir in MODEL_DIRS.items():
+        if (path / subdir).exists():
+            loaders[name] = partial(_model_class(name).load, path / subdir, mmap_mode=mmap_mode)
+        else:
+            loaders[name] = partial(_fit, name, ratings, store, key)
+    return RecommenderBundle(
+        metadata=MovieMetadata.load(path / "metadata", mmap_mode),
+        user_ids=arrays["user_ids"],
+        loaders=loaders,
+        version=key,
+    )
+
+
+def _prepare():
+    if not web_config.use_artifacts:
+        with registry.timer("bundle_load_seconds", source="train"):
+            return _train_bundle()
+
+    try:
+        key = fingerprint(data_config, model_config)
+    except OSError as exc:
+        logger.warning("Dataset missing: %s", exc)
+        return None
+
+    store = ArtifactStore(data_config.artifacts_dir)
+    if store.is_valid(key):
+        try:
+            with registry.timer("bundle_load_seconds", source="artifacts"):
+                bundle = load_bundle(store, key, mmap_mode="r" if web_config.mmap_artifacts else None)
+            logger.info("Loaded model artifacts %s", key)
+            return bundle
+        except Exception as exc:
+            logger.warning("Artifacts %s unreadable, retraining: %s", key, exc)
+
+    with registry.timer("bundle_load_seconds", source="train"):
+        return _train_bundle(store, key)
+
+
+class BundleHolder:
+    """The bundle currently being served; replaced as a whole, never modified in place.
+
+    Requests take one reference at their start, so an update swapped in
+    mid-request never mixes models from two versions. ``start`` loads the
+    first bundle in a background thread; ``get(wait=False)`` returns None
+    until it is there instead of blocking the request. Once metadata and
+    user ids are in the bundle is served ("warming": cache hits work) while
+    the ``preload`` models are built; the state becomes "ready" after that.
+    Every other model is built on first use.
+    """
+
+    def __init__(self, loader, preload=()):
+        self._loader = loader
+        self._preload = tuple(preload)
+        self._bundle = None
+        self._state = "idle"      # idle -> loading -> warming -> ready | unavailable | failed
+        self._error = None
+        self._started = None
+        self._elapsed = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def start(self):
+        """Begin loading in the background (no-op once started)."""
+        with self._lock:
+            if self._state != "idle":
+                return
+            self._state = "loading"
+            self._started = time.perf_counter()
+        threading.Thread(target=self._load, name="bundle-warmup", daemon=True).start()
+
+    def _load(self):
+        error = None
+        try:
+            bundle = self._loader()
+            state = "warming" if bundle is not None else "unavailable"
+        except Exception as exc:
+            logger.exception("Loading the recommender bundle failed")
+            bundle, state, error = None, "failed", str(exc)
+        with self._lock:
+            # một bản cập nhật có thể đã được swap vào trong lúc nạp
+            if self._bundle is None:
+                self._bundle = bundle
+            self._state = "warming" if self._bundle is not None else state
+            self._error = error
+            bundle = self._bundle
+        self._done.set()
+
+        # dựng model nạp trước cho bundle đang phục vụ (kể cả bản cập nhật swap vào giữa chừng)
+        while bundle is not None:
+            bundle.preload(self._preload)
+            with self._lock:
+                if self._bundle is bundle:
+                    self._state = "ready"
+                    break
+                bundle = self._bundle
+        with self._lock:
+            self._elapsed = time.perf_counter() - self._started
+
+    def get(self, wait=True):
+        if self._state == "idle":
+            self.start()
+        if wait:
+            self._done.wait()
+        return self._bundle
+
+    def swap(self, bundle):
+        with self._lock:
+            self._bundle = bundle
+            if bundle is not None and self._state != "warming":
+                self._state = "ready"
+        self._done.set()
+        drop_precomputed(bundle.version if bundle is not None else None)
+
+    @property
+    def state(self):
+        return self._state
+
+    def status(self):
+        with self._lock:
+            bundle = self._bundle
+            return {
+                "state": self._state,
+                "version": bundle.version if bundle is not None else None,
+                "updates": bundle.updates if bundle is not None else 0,
+                "models": bundle.loaded_models if bundle is not None else [],
+                "error": self._error,
+                "load_seconds": round(self._elapsed, 3) if self._elapsed is not None else None,
+            }
+
+
+bundle_holder = BundleHolder(_prepare, preload=web_config.preload_models)
+
+
 def get_recommender_bundle():
+    """A bundle for offline jobs, loaded in the calling thread.
+
+    Bypasses bundle_holder: no ``preload_models`` on a background thread
+    (killed at exit, possibly mid-save), each model is built only when used.
+    """
     return _prepare()
 
 
-def candidate_items(bundle: RecommenderBundle, limit=500):
-    items = bundle.movies["movieId"].tolist()
-    if limit is None:
-        return items
-    return items[:limit]
+def apply_ratings(bundle: RecommenderBundle, ratings: "pd.DataFrame") -> RecommenderBundle:
+    """New bundle with ``ratings`` folded into every model; ``bundle`` keeps serving meanwhile.
+
+    Models already built are updated now; the others get a loader that
+    builds the original model and folds the ratings in on first use.
+    """
+    def update(model):
+        # copy nông: partial_fit chỉ gán lại thuộc tính, model gốc không bị sửa
+        return copy.copy(model).partial_fit(ratings) if model is not None else None
+
+    def update_later(loader):
+        return lambda: update(loader())
+
+    built = [name for name in MODEL_DIRS if bundle.loaded(name)]
+    updated = run_tasks({name: partial(update, bundle.model(name)) for name in built}, n_jobs=model_config.n_jobs)
+    loaders = {name: update_later(bundle._loaders[name]) for name in MODEL_DIRS if name not in updated}
+    if bundle.loaded("hybrid"):
+        # user_cf và svd đã được dựng cùng hybrid -> ghép lại ngay, không để request phải chờ
+        updated["hybrid"] = _make_hybrid(updated["user_cf"], updated["svd"])
+
+    # token theo nội dung rating của từng user: user khác giữ nguyên cache và gợi ý tính sẵn,
+    # và các worker nhận cùng rating sinh cùng token thay vì cùng đếm "+1" cho dữ liệu khác nhau
+    user_versions = dict(bundle.user_versions)
+    for user, rows in ratings.groupby("userId"):
+        digest = hashlib.sha1(user_versions.get(int(user), "").encode())
+        digest.update(rows[["movieId", "rating"]].to_numpy(dtype=np.float64).tobytes())
+        user_versions[int(user)] = digest.hexdigest()[:12]
+
+    return RecommenderBundle(
+        metadata=bundle.metadata,
+        user_ids=np.union1d(bundle.user_ids, ratings["userId"].to_numpy(dtype=bundle.user_ids.dtype)),
+        loaders=loaders,
+        models=updated,
+        version=bundle.version,
+        user_versions=user_versions,
+        updates=bundle.updates + 1,
+    )
+
+
+class RatingUpdater:
+    """Collects submitted ratings and applies them in a background thread.
+
+    Ratings arriving within ``interval`` seconds are applied as one batch; the
+    updated bundle is then swapped into ``holder``.
+    """
+
+    def __init__(self, holder: BundleHolder, interval=None):
+        self.holder = holder
+        self.interval = web_config.update_interval_s if interval is None else interval
+        self._pending = []
+        self._lock = threading.Lock()
+        self._apply_lock = threading.Lock()   # mỗi lần chỉ một lượt cập nhật, không mất batch nào
+        self._wake = threading.Event()
+        self._thread = None
+        self.applied = 0
+
+    def submit(self, ratings: "pd.DataFrame"):
+        """Queue ratings; returns how many are waiting to be applied."""
+        with self._lock:
+            self._pending.append(ratings)
+            pending = sum(len(r) for r in self._pending)
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="rating-updater", daemon=True)
+                self._thread.start()
+        self._wake.set()
+        return pending
+
+    @property
+    def pending(self):
+        with self._lock:
+            return sum(len(r) for r in self._pending)
+
+    def flush(self):
+        """Apply every queued rating now, in the calling thread."""
+        with self._apply_lock:
+            with self._lock:
+                batches, self._pending = self._pending, []
+            bundle = self.holder.get()
+            if not batches or bundle is None:
+                return bundle
+            import pandas as pd
+
+            ratings = pd.concat(batches, ignore_index=True)
+            try:
+                with registry.timer("rating_update_seconds"):
+                    updated = apply_ratings(bundle, ratings)
+            except Exception:
+                logger.exception("Applying %d ratings failed", len(ratings))
+                registry.inc("rating_update_failures_total")
+                return bundle
+            self.holder.swap(updated)
+            self.applied += len(ratings)
+            registry.inc("ratings_applied_total", len(ratings))
+            logger.info("Applied %d ratings (update %d, %d users changed)", len(ratings), updated.updates,
+                        len(updated.user_versions))
+            return updated
+
+    def _run(self):
+        while True:
+            self._wake.wait()
+            self._wake.clear()
+            time.sleep(self.interval)
+            self.flush()
+
+
+rating_updater = RatingUpdater(bundle_holder)
+
+
+def ranker(bundle: RecommenderBundle, algorithm: str, top_n):
+    """Batch ranker ``fn(user_ids) -> (user_ids, movie_ids, scores, totals)``, None when the model is unavailable.
+
+    Same candidate sets as the live endpoints; users a model does not know
+    are left out of its output (the hybrid ranks everyone). Only the model
+    of ``algorithm`` is built.
+    """
+    if algorithm == "hybrid":
+        return partial(bundle.hybrid.rank_many, movies=bundle.metadata, top_n=top_n)
+    model = bundle.model(algorithm)
+    return partial(model.rank_many, top_n=top_n) if model is not None else None
+
+
+def precomputed_dir(bundle: RecommenderBundle):
+    """Where the batch job stores this model version's precomputed recommendations."""
+    # user có rating mới không dùng gợi ý tính sẵn (xem RecommenderBundle.has_new_ratings)
+    if not bundle.version:
+        return None
+    return ArtifactStore(data_config.artifacts_dir).path(bundle.version) / "recommendations"
+
+
+_precomputed = {}   # (version, algorithm) -> PrecomputedRecommendations
+_precomputed_lock = threading.Lock()
+
+
+def drop_precomputed(keep_version):
+    """Forget the loaded batch tables of every version except ``keep_version``."""
+    with _precomputed_lock:
+        for key in [k for k in _precomputed if k[0] != keep_version]:
+            del _precomputed[key]
+
+
+def get_precomputed(bundle: RecommenderBundle, algorithm: str):
+    """Memory-mapped batch results for ``algorithm``, or None until the batch job has written them."""
+    root = precomputed_dir(bundle)
+    if not web_config.use_precomputed or root is None:
+        return None
+    key = (bundle.version, algorithm)
+    with _precomputed_lock:
+        found = _precomputed.get(key)
+    if found is None:
+        path = root / algorithm
+        if not (path / "meta.json").exists():
+            return None
+        from src.batch import PrecomputedRecommendations
+
+        try:
+            found = PrecomputedRecommendations.load(path, mmap_mode="r")
+        except (OSError, ValueError, KeyError) as exc:
+            logger.warning("Precomputed recommendations %s unreadable: %s", path, exc)
+            return None
+        with _precomputed_lock:
+            found = _precomputed.setdefault(key, found)
+    return found